@@ -0,0 +1,400 @@
+"""
+randnet.py
+
+Simulates ensembles of the randomly connected rate network
+    dx_i/dt = -x_i + sum_j J_ij tanh(g x_j)
+where the couplings J_ij are independent Gaussians of variance J2/N with no
+self coupling.
+
+Realizations of the network are advanced together: their states are stacked
+into an (ensemble, N) array and the coupling term for all of them is one
+batched matrix product.  An ensemble is split into batches that run in
+separate processes, and the parameters of a run are given as a config
+dictionary (see DEFAULTS) rather than edited into a copy of the script.
+
+Besides odeint, the network can be integrated with fixed step RK4 or
+exponential Euler (integrate_fixed), which work in preallocated buffers and
+spend nearly all their time in BLAS matrix products.
+
+For large networks the couplings can instead be a scipy.sparse matrix with a
+fixed in-degree K (sparse_coupling_matrix) or a random matrix plus a low rank
+structure kept in factored form (LowRankCoupling), so memory grows like N K
+rather than N**2.  Everything that takes J accepts any of these.
+"""
+
+import multiprocessing
+
+import numpy as np
+import scipy.sparse
+from scipy.integrate import odeint
+
+# parameters of an ensemble run, override any of them in the config passed to run_ensemble
+DEFAULTS = {
+    'N': 1000,              # number of network elements
+    'ensemble': 100,        # number of network realizations
+    'J': 1.1,               # coupling strength, the matrix elements have variance J**2 / N
+    'g': 1.0,               # gain of the tanh nonlinearity
+    't_transient': 3000.0,  # time allowed for the transient to run out
+    'dt_transient': 1.0,    # output step of odeint, fixed step methods take steps of dt_transient / substeps
+    't_run': 4000.0,        # length of the data collection period
+    'dt': 0.1,
+    'record': (0, 1),       # elements whose time series are kept
+    'K': None,              # in-degree of sparse couplings, None for dense ones
+    'rank': 0,              # rank of the structured part added to the random couplings
+    'method': 'odeint',     # 'odeint', or fixed step 'rk4' or 'expeuler'
+    'substeps': 1,          # fixed steps per dt (and per dt_transient)
+    'seed': 0,              # realization n is drawn from RandomState(seed + n)
+    'batch': 10,            # realizations integrated together by each process
+    'processes': None,      # size of the process pool, None uses every core
+}
+
+def coupling_matrix(N, J2, rng=np.random):
+    """
+    Returns an N x N matrix of independent Gaussian couplings with variance
+    J2/N and zeros on the diagonal.
+    """
+
+    J = np.sqrt(J2 / N) * rng.randn(N, N)
+    np.fill_diagonal(J, 0.0)
+    return J
+
+def sparse_coupling_matrix(N, K, J2, rng=np.random):
+    """
+    Returns an N x N sparse (CSR) coupling matrix in which every element
+    receives input from K others, chosen at random without self coupling.
+    The nonzero couplings are Gaussian with variance J2/K, so the summed input
+    to each element has the same variance J2 as in coupling_matrix.
+    """
+
+    if not 0 < K < N:
+        raise ValueError("K must be between 1 and N - 1")
+    # draw the K inputs of every row with replacement, skipping the diagonal,
+    # and redraw the rows that came out with a repeated input.  Repeats are
+    # rare when K**2 < N; otherwise those rows are drawn one at a time.
+    rows = np.arange(N)
+    cols = np.empty((N, K), dtype=int)
+    while len(rows):
+        draw = rng.randint(0, N - 1, size=(len(rows), K))
+        draw.sort(axis=1)
+        draw += draw >= rows[:, None]
+        cols[rows] = draw
+        rows = rows[(np.diff(draw, axis=1) == 0).any(axis=1)]
+        if K * K >= N:
+            for i in rows:
+                cols[i] = np.sort(rng.choice(N - 1, K, replace=False))
+                cols[i] += cols[i] >= i
+            break
+
+    data = np.sqrt(J2 / K) * rng.randn(N * K)
+    indptr = np.arange(0, N * K + 1, K)
+    return scipy.sparse.csr_matrix((data, cols.ravel(), indptr), shape=(N, N))
+
+class LowRankCoupling(object):
+    # Couplings J = random + U V^T, with the structured part kept as its factors.
+    # Data stored are:
+    # random - the random part, any coupling taken by couple: a dense (N, N) array,
+    #     a stack of (ensemble, N, N) arrays, or a scipy.sparse matrix
+    # U, V - the factors of the structured part, (N, rank) dense or sparse, or
+    #     (ensemble, N, rank) stacks to go with a stacked random part
+    def __init__(self, random, U, V):
+        self.random = random
+        self.U = U
+        self.V = V
+        self.shape = random.shape
+        self.ndim = random.ndim
+
+    def dot(self, r, out=None):
+        # J r for a state or a stack of states, as couple
+        VT = self.V.T if self.V.ndim == 2 else self.V.transpose(0, 2, 1)
+        out = couple(self.random, r, out)
+        out += couple(self.U, couple(VT, r))
+        return out
+
+def low_rank_coupling(N, J2, rank, K=None, rng=np.random):
+    """
+    Returns a LowRankCoupling whose random part is coupling_matrix(N, J2), or
+    sparse_coupling_matrix(N, K, J2) if K is given, plus a structured part
+    U V^T / N with independent standard Gaussian factors U and V of shape
+    (N, rank).
+    """
+
+    if K is None:
+        random = coupling_matrix(N, J2, rng)
+    else:
+        random = sparse_coupling_matrix(N, K, J2, rng)
+    U = rng.randn(N, rank)
+    V = rng.randn(N, rank) / N
+    return LowRankCoupling(random, U, V)
+
+def couple(J, r, out=None):
+    """
+    Returns the coupling term J r for a state r of shape (N,) or a stack of
+    states of shape (ensemble, N), written into out if it is given.  J may be
+        a dense (N, N) array shared by every state
+        a stack of (ensemble, N, N) arrays, one per state
+        a scipy.sparse matrix shared by every state
+        a LowRankCoupling
+    The dense products go straight into out through BLAS; the sparse ones
+    need a temporary.
+    """
+
+    if isinstance(J, LowRankCoupling):
+        return J.dot(r, out)
+    if scipy.sparse.issparse(J):
+        Jr = J.dot(r.T).T
+        if out is None:
+            return Jr
+        out[...] = Jr
+        return out
+
+    if out is None:
+        out = np.empty(r.shape[:-1] + (J.shape[-2],))
+    if J.ndim == 3:
+        np.matmul(J, r[..., None], out=out[..., None])
+    elif r.ndim == 1:
+        np.dot(J, r, out=out)
+    else:
+        np.dot(r, J.T, out=out)
+    return out
+
+def dxdt(x, t, g, J):
+    """
+    Returns dx/dt for a state x of shape (N,) or a stack of states of shape
+    (ensemble, N).  J is any of the couplings taken by couple: one (N, N)
+    matrix shared by every state, a stack of (ensemble, N, N) matrices, one
+    per state, a sparse matrix or a LowRankCoupling.
+    """
+
+    return couple(J, np.tanh(g * x)) - x
+
+def _flat_dxdt(x, t, g, J, shape):
+    # odeint works on flat vectors
+    return dxdt(x.reshape(shape), t, g, J).ravel()
+
+def integrate(x0, times, g, J):
+    """
+    Integrates a state or a stack of states with odeint, returning the
+    solution at times with shape (len(times),) + x0.shape.  Stacked states
+    share the adaptive step, so a batch costs about as many steps as one
+    realization.
+    """
+
+    x0 = np.asarray(x0, dtype=float)
+    sol = odeint(_flat_dxdt, x0.ravel(), times, (g, J, x0.shape))
+    return sol.reshape((len(times),) + x0.shape)
+
+def integrate_fixed(x0, g, J, dt, nsteps, method='rk4', every=1, keep=None, final_only=False,
+                    observe=None):
+    """
+    Integrates dx/dt = -x + J tanh(g x) for nsteps fixed steps of length dt,
+    for a state or a stack of states as in dxdt.  All work is done in buffers
+    allocated up front.  With a dense J the coupling term is one BLAS product:
+    a gemv for one state, a gemm for a stack of states sharing an (N, N)
+    matrix, or a batched gemv for a stack with one matrix per state.
+
+    Arguments:
+        method: 'rk4' for the classical fourth order Runge-Kutta method, or
+            'expeuler' for exponential Euler, which integrates the linear -x
+            term exactly: x <- exp(-dt) x + (1 - exp(-dt)) J tanh(g x).
+        every: the state is saved every this many steps.
+        keep: indices of the elements to save, None saves them all.
+        final_only: only return the final state, for running out transients.
+        observe: if given, called as observe(n, x) with the step number and the
+            full state whenever a state is saved.  x is the integrator's own
+            buffer, so copy anything that is to be kept.
+
+    Returns the final state if final_only, otherwise an array of the saved
+    states at t = 0, every*dt, 2*every*dt, ... with shape
+    (nsteps // every + 1,) + x0.shape (the last axis cut down to keep).
+    """
+
+    if method not in ('rk4', 'expeuler'):
+        raise ValueError("method must be 'rk4' or 'expeuler'")
+    x = np.array(x0, dtype=float)
+    r = np.empty_like(x)
+    k1 = np.empty_like(x)
+    if method == 'rk4':
+        k2 = np.empty_like(x)
+        k3 = np.empty_like(x)
+        k4 = np.empty_like(x)
+        xt = np.empty_like(x)
+    decay = np.exp(-dt)
+
+    if not final_only:
+        shape = x.shape if keep is None else x.shape[:-1] + (len(keep),)
+        sol = np.empty((nsteps // every + 1,) + shape)
+        sol[0] = x if keep is None else x[..., keep]
+    if observe is not None:
+        observe(0, x)
+
+    def rhs(y, out):
+        np.multiply(y, g, out=r)
+        np.tanh(r, out=r)
+        couple(J, r, out)
+        out -= y
+
+    for n in range(1, nsteps + 1):
+        if method == 'rk4':
+            rhs(x, k1)
+            np.multiply(k1, 0.5 * dt, out=xt)
+            xt += x
+            rhs(xt, k2)
+            np.multiply(k2, 0.5 * dt, out=xt)
+            xt += x
+            rhs(xt, k3)
+            np.multiply(k3, dt, out=xt)
+            xt += x
+            rhs(xt, k4)
+            # x += dt/6 (k1 + 2 k2 + 2 k3 + k4)
+            k2 += k3
+            k2 *= 2.0
+            k1 += k2
+            k1 += k4
+            k1 *= dt / 6.0
+            x += k1
+        else:
+            np.multiply(x, g, out=r)
+            np.tanh(r, out=r)
+            couple(J, r, k1)
+            k1 *= 1.0 - decay
+            x *= decay
+            x += k1
+        if n % every == 0:
+            if not final_only:
+                sol[n // every] = x if keep is None else x[..., keep]
+            if observe is not None:
+                observe(n, x)
+
+    return x if final_only else sol
+
+def _block_diag(couplings):
+    # one block diagonal coupling for a list of sparse realizations, or of low rank ones with sparse
+    # random parts
+    if isinstance(couplings[0], LowRankCoupling):
+        return LowRankCoupling(_block_diag([c.random for c in couplings]),
+                               _block_diag([c.U for c in couplings]),
+                               _block_diag([c.V for c in couplings]))
+    return scipy.sparse.block_diag(couplings, format='csr')
+
+def _run_times(cfg):
+    # times the data collection period is recorded at: odeint is asked for
+    # exactly these, the fixed step methods save every substeps steps of
+    # dt / substeps
+    if cfg['method'] == 'odeint':
+        return np.arange(0.0, cfg['t_run'] + cfg['dt'], cfg['dt'])
+    return cfg['dt'] * np.arange(int(round(cfg['t_run'] / cfg['dt'])) + 1)
+
+def run_batch(config, seeds):
+    """
+    Draws and simulates one realization per seed, integrated together.  The
+    transient is run out and discarded, then the data collection period is
+    integrated.  Returns the final states, shape (len(seeds), N), and the time
+    series of the recorded elements, shape (len(seeds), len(times),
+    len(record)).
+
+    Dense couplings are stacked and applied by one batched product, and so
+    are dense random parts with a low rank structure (config['rank']), whose
+    factors are stacked alongside.  Sparse realizations (config['K']) are
+    instead run as a single network of len(seeds) * N elements with block
+    diagonal couplings.
+    """
+
+    cfg = dict(DEFAULTS)
+    cfg.update(config)
+    N = cfg['N']
+    E = len(seeds)
+    J2 = cfg['J'] * cfg['J']
+    dense = cfg['K'] is None
+
+    if dense:
+        J = np.zeros((E, N, N))
+        U = np.zeros((E, N, cfg['rank']))
+        V = np.zeros((E, N, cfg['rank']))
+    else:
+        J = []
+    x = np.zeros((E, N))
+    for n, seed in enumerate(seeds):
+        rng = np.random.RandomState(seed)
+        if cfg['rank']:
+            c = low_rank_coupling(N, J2, cfg['rank'], cfg['K'], rng)
+        elif dense:
+            c = coupling_matrix(N, J2, rng)
+        else:
+            c = sparse_coupling_matrix(N, cfg['K'], J2, rng)
+        if not dense:
+            J.append(c)
+        elif cfg['rank']:
+            J[n], U[n], V[n] = c.random, c.U, c.V
+        else:
+            J[n] = c
+        x[n] = rng.randn(N)
+
+    record = list(cfg['record'])
+    if dense and cfg['rank']:
+        J = LowRankCoupling(J, U, V)
+    elif not dense:
+        J = _block_diag(J)
+        x = x.ravel()
+        record = list((N * np.arange(E)[:, None] + record).ravel())
+
+    if cfg['method'] == 'odeint':
+        # let the transient run out
+        times = np.arange(0.0, cfg['t_transient'] + cfg['dt_transient'], cfg['dt_transient'])
+        x = integrate(x, times, cfg['g'], J)[-1]
+
+        # now run for a while to collect data
+        times = _run_times(cfg)
+        sol = integrate(x, times, cfg['g'], J)
+        return sol[-1].reshape(E, N), sol[..., record].reshape(len(times), E, -1).transpose(1, 0, 2)
+
+    # the transient is not recorded, so it can take the longer steps of dt_transient
+    h = cfg['dt_transient'] / cfg['substeps']
+    x = integrate_fixed(x, cfg['g'], J, h, int(round(cfg['t_transient'] / h)), cfg['method'],
+                        final_only=True)
+    h = cfg['dt'] / cfg['substeps']
+    nsteps = (len(_run_times(cfg)) - 1) * cfg['substeps']
+    final = np.empty_like(x)
+
+    def save_final(n, y):
+        if n == nsteps:
+            final[...] = y
+
+    sol = integrate_fixed(x, cfg['g'], J, h, nsteps, cfg['method'], cfg['substeps'], record,
+                          observe=save_final)
+    return final.reshape(E, N), sol.reshape(len(sol), E, -1).transpose(1, 0, 2)
+
+def _run_batch(args):
+    return run_batch(*args)
+
+def run_ensemble(config):
+    """
+    Simulates config['ensemble'] realizations of the network, in batches of
+    config['batch'] spread over a pool of config['processes'] processes.
+
+    Returns a dictionary with
+        seeds: the seed each realization was drawn from
+        times: times of the data collection period
+        final: final states, shape (ensemble, N)
+        record: time series of the recorded elements, shape
+            (ensemble, len(times), len(record))
+    """
+
+    cfg = dict(DEFAULTS)
+    cfg.update(config)
+    seeds = [cfg['seed'] + n for n in range(cfg['ensemble'])]
+    batches = [(cfg, seeds[n:n + cfg['batch']]) for n in range(0, len(seeds), cfg['batch'])]
+
+    if cfg['processes'] == 1:
+        results = [_run_batch(b) for b in batches]
+    else:
+        pool = multiprocessing.Pool(cfg['processes'])
+        try:
+            results = pool.map(_run_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+
+    return {'seeds': np.array(seeds),
+            'times': _run_times(cfg),
+            'final': np.concatenate([r[0] for r in results]),
+            'record': np.concatenate([r[1] for r in results])}
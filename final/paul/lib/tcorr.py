@@ -0,0 +1,109 @@
+"""
+tcorr.py
+
+Population time-correlation functions of network trajectories.  The
+autocorrelation of every element is computed through its power spectrum
+(Wiener-Khinchin): the trajectories are zero padded to at least T + max_lag
+samples, so the circular correlation of the FFT equals the linear one, and
+the power spectra of all elements are summed before a single inverse FFT.
+This costs O(N T log T) rather than the O(N T**2) of np.correlate element by
+element.
+
+LagCorrelator gives the same result up to a chosen largest lag without the
+trajectory: it is fed states as they are integrated and needs memory for
+only max_lag + 1 of them.
+"""
+
+import numpy as np
+
+def _fft_len(n):
+    # smallest power of two that is at least n
+    return 1 << int(n - 1).bit_length()
+
+def autocorr(sol, max_lag=None, chunk=64):
+    """
+    Returns the autocorrelation summed over elements,
+        c[k] = sum_i sum_t sol[t+k, i] sol[t, i]
+    for lags k = 0, ..., max_lag, from a trajectory of shape (T, N).
+
+    Arguments:
+        max_lag: the largest lag returned, None for all T - 1 of them.  Only
+            the padding needed for these lags is used.
+        chunk: number of elements transformed at once, which bounds the
+            memory used to about chunk * T complex numbers.
+    """
+
+    sol = np.asarray(sol, dtype=float)
+    if sol.ndim == 1:
+        sol = sol[:, None]
+    T, N = sol.shape
+    if max_lag is None or max_lag > T - 1:
+        max_lag = T - 1
+
+    nfft = _fft_len(T + max_lag)
+    power = np.zeros(nfft // 2 + 1)
+    for i in range(0, N, chunk):
+        F = np.fft.rfft(sol[:, i:i + chunk], n=nfft, axis=0)
+        power += (F.real * F.real + F.imag * F.imag).sum(axis=1)
+    return np.fft.irfft(power, n=nfft)[:max_lag + 1]
+
+def full_corr(c):
+    """
+    Returns the lags -max_lag, ..., max_lag of an autocorrelation given at
+    lags 0, ..., max_lag, laid out as np.correlate(..., mode='full').
+    """
+
+    return np.concatenate((c[:0:-1], c))
+
+def corr_vec(sol, max_lag=None, chunk=64):
+    """
+    Returns the normalized population time-correlation function of a
+    trajectory of shape (T, N), at lags -max_lag, ..., max_lag:
+        sum_i np.correlate(sol[:,i], sol[:,i], mode='full')
+    divided by N times its Euclidean norm.  With max_lag the norm is taken
+    over the lags returned.
+    """
+
+    N = np.shape(sol)[1] if np.ndim(sol) > 1 else 1
+    corr = full_corr(autocorr(sol, max_lag, chunk))
+    corr /= N * np.sqrt(np.dot(corr, corr))
+    return corr
+
+class LagCorrelator(object):
+    # Accumulates the population autocorrelation of a trajectory fed one state at a time, so the
+    # trajectory itself never has to be stored.  The last max_lag + 1 states are kept in a ring
+    # buffer and each new state is dotted with all of them, O(N max_lag) memory and work per state.
+    # Data stored are:
+    # max_lag - the largest lag accumulated, in states
+    # n - the number of states seen
+    # sums - sums[k] = sum_t x[t+k] . x[t] over the states seen so far
+    def __init__(self, N, max_lag):
+        self.max_lag = max_lag
+        self.n = 0
+        self.sums = np.zeros(max_lag + 1)
+        self._buf = np.zeros((max_lag + 1, N))
+        self._dots = np.zeros(max_lag + 1)
+        self._lags = np.arange(max_lag + 1)
+
+    def add(self, x):
+        # x is a state of N elements, or any array of N elements in all (a stack of states)
+        pos = self.n % (self.max_lag + 1)
+        self._buf[pos] = np.ravel(x)
+        np.dot(self._buf, self._buf[pos], out=self._dots)
+        # slot pos - k holds the state k steps back; slots not yet filled are zero
+        self.sums += self._dots[(pos - self._lags) % (self.max_lag + 1)]
+        self.n += 1
+
+    def observe(self, n, x):
+        # for use as the observe callback of randnet.integrate_fixed
+        self.add(x)
+
+    def autocorr(self):
+        # the same as autocorr(sol, max_lag) on the states seen
+        return self.sums[:min(self.max_lag + 1, self.n)].copy()
+
+    def corr_vec(self):
+        # the same as corr_vec(sol, max_lag) on the states seen
+        corr = full_corr(self.autocorr())
+        corr /= self._buf.shape[1] * np.sqrt(np.dot(corr, corr))
+        return corr
@@ -1,26 +1,26 @@
 # calculates autocorrelation as a function of time for the randomly connected
 # network model
 
-import time
+import os, sys, time
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from scipy.integrate import odeint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import randnet
+import tcorr
 
 # seed random number generator
 np.random.seed(19870328)
 
 N = 256  # number of network elements
+max_lag = 2000  # largest lag of the time-correlation function, in steps of dt
 # generate instance of random matrix
 J_orig = np.random.randn(N,N)
 
 # create array of desired Jsig vals
 Jvec = (1.248, 1.249, 1.251, 1.252)
 
-# equations of motion
-def dxdt(x, t, gJ, J):
-    return -x + np.einsum('ij,j', J, np.tanh(gJ*x))
-
 for Jval in Jvec:
     # rescale variance of matrix elements
     J2 = Jval*Jval
@@ -42,10 +42,8 @@ for Jval in Jvec:
     t0 = 0.0
     tf = 10000.0
     dt = 0.1
-    times = np.arange(t0, tf+dt, dt)
     
-    sol = odeint(dxdt, x, times, (gJ,J))
-    x = sol[-1]
+    x = randnet.integrate_fixed(x, gJ, J, dt, int(round((tf - t0)/dt)), final_only=True)
     print time.time()-tstart, ' s'
     
     # now generate time series data
@@ -53,11 +51,11 @@ for Jval in Jvec:
     t0 = 0.0
     tf = 10000.0
     dt = 0.1
-    Nt = (tf+dt - t0)/dt
-    times = np.arange(t0, tf+dt, dt)
     
-    sol = odeint(dxdt, x, times, (gJ,J))
-    x = sol[-1]
+    # only the elements plotted are kept, the rest go straight into the correlator
+    corr = tcorr.LagCorrelator(N, max_lag)
+    sol = randnet.integrate_fixed(x, gJ, J, dt, int(round((tf - t0)/dt)), keep=[0, 1, 2],
+                                  observe=corr.observe)
     print time.time()-tstart, ' s'
     
     # plot phase space trajectories
@@ -78,10 +76,7 @@ for Jval in Jvec:
     
     # now calculate and plot time-correlation function
     tstart = time.time()
-    corr_vec = np.zeros(Nt*2 - 1)
-    for i in range(N):
-        corr_vec += np.correlate(sol[:,i], sol[:,i], mode='full')
-    corr_vec /= (N * np.sqrt(np.einsum('i,i', corr_vec, corr_vec)))
+    corr_vec = corr.corr_vec()
     print time.time()-tstart, ' s'
     
     fig = plt.figure()
@@ -0,0 +1,40 @@
+# Runs an ensemble of random network realizations and saves a phase space plot
+# of each.  Replaces testloopA.py - testloopD.py, which differed only in J:
+#     python testloop.py A        (or B, C, D)
+#     python testloop.py 1.3      (any other J)
+
+from __future__ import print_function
+
+import os, sys, time
+import numpy as np
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import randnet
+
+CONFIGS = {
+    'A': {'J': 1.1},
+    'B': {'J': 1.15},
+    'C': {'J': 1.2},
+    'D': {'J': 1.25},
+}
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'A'
+    config = CONFIGS[name] if name in CONFIGS else {'J': float(name)}
+    Jval = config['J']
+
+    tstart = time.time()  # timing purposes
+    result = randnet.run_ensemble(config)
+    print(time.time() - tstart, ' s')
+
+    # the seeds reproduce any realization whose transient has not run out
+    np.savez('data_testloop/ensemble_J_' + str(Jval) + '.npz', **result)
+
+    for nrun, rec in enumerate(result['record']):
+        fig = plt.figure()
+        ax = fig.add_subplot(1,1,1)
+        ax.plot(rec[:,0], rec[:,1])
+        fname = 'figs_testloop/ps_J_' + str(Jval) + '_run' + str(nrun) + '.pdf'
+        fig.savefig(fname)
+        plt.close(fig)
@@ -0,0 +1,973 @@
+"""
+Ising model Monte Carlo samplers used in Ising_Model_Testing.ipynb and
+Ising_CS.ipynb.
+
+The lattice is a 2D grid of +/-1 spins with nearest neighbor couplings and
+periodic boundary conditions.  Besides the single spin samplers from the
+notebooks, the models can be advanced a whole sublattice at a time with
+sweep() or by flipping clusters of spins with wolff() and swendsen_wang(),
+and IsingEnsemble runs a set of temperatures together with parallel
+tempering.
+
+States are int8 arrays of +/-1.  pack_state stores them at 1 bit per spin
+for saving trajectories, and MultiSpinIsing keeps 64 replicas per machine
+word and updates them with bitwise operations.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from mcstats import run_until
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _acceptance(method, T):
+    # Acceptance probabilities for the local fields b = -4, -2, 0, 2, 4 (indexed by (b + 4) / 2)
+    # at each of the temperatures T.  For Gibbs sampling this is the probability of setting the
+    # spin up, for Metropolis sampling the probability of flipping a spin with s * b = b
+    b = np.arange(-4, 5, 2)
+    T = np.asarray(T, dtype=float)[..., None]
+    if method == 'gibbs':
+        return 1. / (1. + np.exp(-2. * b / T))
+    elif method == 'metropolis':
+        return np.minimum(1., np.exp(-2. * b / T))
+    else:
+        raise ValueError("method must be 'gibbs' or 'metropolis'")
+
+
+def _sublattices(shape):
+    # Boolean masks of sites with no bonds between them.  Sites are grouped by checkerboard
+    # color and by whether they sit on the last row or column when that dimension is odd
+    rows, cols = shape
+    i, j = np.indices(shape)
+    group = (i + j) % 2
+    if rows % 2:
+        group = group + 2 * (i == rows - 1)
+    if cols % 2:
+        group = group + 4 * (j == cols - 1)
+    return [group == g for g in np.unique(group)]
+
+
+def _neighbor_table(shape):
+    # (sites, 4) array of the flat indices of the neighbors of each site under periodic boundary conditions
+    idx = np.arange(shape[0] * shape[1]).reshape(shape)
+    nbrs = [np.roll(idx, 1, 1), np.roll(idx, -1, 1), np.roll(idx, 1, 0), np.roll(idx, -1, 0)]
+    return np.column_stack([n.ravel() for n in nbrs])
+
+
+def _union_find(n, a, b):
+    # Labels the connected components of the graph on n nodes with edges a[k] - b[k].  Every node is
+    # labelled with the smallest node in its component.  All edges are processed at once: the larger of
+    # the two roots of every edge is hooked onto the smaller and the trees are then flattened by pointer
+    # jumping, repeating with the edges that still join two trees until none are left.
+    parent = np.arange(n)
+    a = np.asarray(a)
+    b = np.asarray(b)
+    while a.size:
+        ra = parent[a]
+        rb = parent[b]
+        join = ra != rb
+        a, b, ra, rb = a[join], b[join], ra[join], rb[join]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        grand = parent[parent]
+        while np.any(grand != parent):
+            parent = grand
+            grand = parent[parent]
+    return parent
+
+
+def _random_spins(shape, rng=np.random):
+    return rng.choice(np.array([-1, 1], dtype=np.int8), shape)
+
+
+def pack_state(state):
+    """
+    Packs an array of +/-1 spins into 1 bit per spin (1 for up), flattening all but the first axis when
+    there is more than one so that each replica of an ensemble gets its own row of bytes.
+    """
+    state = np.asarray(state)
+    if state.ndim > 2:
+        return np.packbits(state.reshape(state.shape[0], -1) > 0, axis=1)
+    return np.packbits(state.ravel() > 0)
+
+
+def unpack_state(packed, shape):
+    """
+    Inverse of pack_state, returning an int8 array of +/-1 spins of the given shape.
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    sites = int(np.prod(shape[-2:]))
+    bits = np.unpackbits(packed, axis=-1)[..., :sites]
+    return (2 * bits.astype(np.int8) - 1).reshape(shape)
+
+
+def _single_spin_loop(state, spins_i, spins_j, r, table, gibbs):
+    # Sequential Gibbs or Metropolis updates of the spins at (spins_i[n], spins_j[n]) against the uniform
+    # numbers r[n], looking the acceptance probabilities up from table as in Ising.sweep.  Returns the
+    # changes in energy and magnetization.  Only scalar operations are used so numba can compile it as is.
+    rows, cols = state.shape
+    dE = 0
+    dM = 0
+    for n in range(spins_i.shape[0]):
+        i = spins_i[n]
+        j = spins_j[n]
+        b = (int(state[(i - 1) % rows, j]) + int(state[(i + 1) % rows, j]) +
+             int(state[i, (j - 1) % cols]) + int(state[i, (j + 1) % cols]))
+        spin = int(state[i, j])
+        if gibbs:
+            new = 1 if r[n] < table[(b + 4) // 2] else -1
+        else:
+            new = -spin if r[n] < table[(spin * b + 4) // 2] else spin
+        if new != spin:
+            state[i, j] = new
+            dE += (spin - new) * b
+            dM += new - spin
+    return dE, dM
+
+
+_single_spin_jit = None if njit is None else njit(_single_spin_loop)
+
+
+def benchmark(shape=(64, 64), T=2.27, sweeps=10, method='metropolis', seed=0):
+    """
+    times = benchmark(shape=(64, 64), T=2.27, sweeps=10, method='metropolis', seed=0)
+
+    Times sweeps * sites random-site updates of an Ising model with each available backend, starting
+    from the same seeded state, and checks that the backends end in the same state.  Returns a dict of
+    the seconds taken by each backend.
+    """
+    import time
+    backends = ['numpy'] if _single_spin_jit is None else ['numpy', 'numba']
+    times = {}
+    finals = []
+    for backend in backends:
+        if backend == 'numba':
+            # compile outside the timing
+            warm = Ising((4, 4), T, seed=seed)
+            warm.gibbs(1)
+            warm.metropolis(1)
+        model = Ising(shape, T, seed=seed)
+        model.backend = backend
+        N = sweeps * model.sites
+        start = time.time()
+        getattr(model, method)(N)
+        times[backend] = time.time() - start
+        finals.append(model.state)
+        print("%-6s %8.3f s  %8.3f us per update" % (backend, times[backend], 1e6 * times[backend] / N))
+    if len(finals) > 1 and not np.array_equal(finals[0], finals[1]):
+        print("Warning: the backends ended in different states")
+    return times
+
+
+class RingBuffer(object):
+    # A preallocated buffer of rows of observables.  Once it is full, each new row overwrites the oldest.
+    # A uint8 buffer as wide as a packed state can hold a trajectory of snapshots.
+    def __init__(self, capacity, width=1, dtype=float):
+        self.data = np.zeros((capacity, width), dtype=dtype)
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.count % len(self.data)] = row
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, len(self.data))
+
+    def values(self):
+        # Returns the stored rows, oldest first
+        if self.count <= len(self.data):
+            return self.data[:self.count].copy()
+        return np.roll(self.data, -(self.count % len(self.data)), axis=0)
+
+
+class Ising(object):
+    # Implements an Ising model.
+    # Data stored by the model are:
+    # state - the current state of the model, an int8 array of +/-1
+    # temp - the temperature of the model
+    # rows
+    # cols
+    # history - a RingBuffer of (energy, magnetization) measurements, see record()
+    # The energy and magnetization are kept up to date by the samplers and recounted whenever state
+    # is assigned, so the state should be replaced rather than modified in place from outside.
+    def __init__(self, shape, T, init=None, seed=None):
+        # initialize the state and temperature of the ising model.  With a seed the model draws from its
+        # own random number generator, otherwise from numpy's global one
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        # single spin updates run compiled when numba is available, see _single_spin
+        self.backend = 'numpy' if _single_spin_jit is None else 'numba'
+        if init is None:
+            self.state = _random_spins(shape, self.rng)
+        else:
+            self.state = init
+
+        if self.state.shape != tuple(shape):
+            print("The inital state does not match the shape!")
+            print("Repairing")
+            shape = self.state.shape
+
+        self.temp = T
+        self.rows = self.state.shape[0]
+        self.cols = self.state.shape[1]
+        self.sites = self.rows * self.cols
+
+        # sites that the samplers may not change
+        self._clamped = np.zeros(self.state.shape, dtype=bool)
+
+        # sublattice masks, acceptance tables and neighbor indices are built on first use
+        self._masks = None
+        self._tables = {}
+        self._nbrs = None
+
+        self.history = None
+        self._every = self.sites
+        self._steps = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, newstate):
+        self._state = np.asarray(newstate, dtype=np.int8)
+        self._recount()
+
+    def _recount(self):
+        # Recomputes the energy and magnetization from scratch and drops the cluster labels
+        s = self._state
+        self._E = -float(np.sum(s * (np.roll(s, 1, 0) + np.roll(s, 1, 1))))
+        self._M = np.sum(s)
+        self._labels = None
+
+    def record(self, capacity, every=None):
+        # Starts recording the energy and magnetization into self.history, a RingBuffer holding the last
+        # capacity measurements.  gibbs and metropolis record every `every` updates (default self.sites),
+        # sweep, wolff and swendsen_wang after each sweep or cluster update.  record(None) stops recording.
+        if capacity is None:
+            self.history = None
+        else:
+            self.history = RingBuffer(capacity, 2)
+            self._every = every or self.sites
+            self._steps = 0
+
+    def _log(self):
+        if self.history is not None:
+            self.history.append((self._E, self._M))
+
+    def set_temp(self, T):
+        self.temp = T
+
+    def new_state(self, newstate):
+        # the only reason this is here is to ensure that the shape is correct
+        if newstate.shape == self.state.shape:
+            self.state = newstate
+        else:
+            print("State does not match dimensions")
+
+    def randomize(self):
+        # this is an initial state when evolving the network to a state of high energy
+        self.state = _random_spins(self.state.shape, self.rng)
+
+    def ground_state(self):
+        # this is an inital state when evolving the network to a state of low energy
+        self.state = -np.ones(self.state.shape, dtype=np.int8)
+
+    def snapshot(self):
+        # Returns the state packed into 1 bit per spin, see pack_state
+        return pack_state(self.state)
+
+    def restore(self, packed):
+        self.new_state(unpack_state(packed, self.state.shape))
+
+    def neighbors(self, i, j):
+        # Return a list of tuples containing the indices of the neighbors of (i, j) under
+        # periodic boundary conditions
+        nearby = [(0, 0)] * 4
+        if j == 0:
+            nearby[0] = (i, self.cols - 1)
+            nearby[1] = (i, 1)
+        elif j == self.cols - 1:
+            nearby[0] = (i, j - 1)
+            nearby[1] = (i, 0)
+        else:
+            nearby[0] = (i, j - 1)
+            nearby[1] = (i, j + 1)
+
+        if i == 0:
+            nearby[2] = (self.rows - 1, j)
+            nearby[3] = (1, j)
+        elif i == self.rows - 1:
+            nearby[2] = (i - 1, j)
+            nearby[3] = (0, j)
+        else:
+            nearby[2] = (i - 1, j)
+            nearby[3] = (i + 1, j)
+
+        return nearby
+
+    def local_field(self, i, j):
+        # Returns the sum of the neighboring spins of (i, j) under periodic boundary conditions
+        b_ij = 0
+        for k, l in self.neighbors(i, j):
+            b_ij = b_ij + self.state[k, l]
+        return b_ij
+
+    def local_fields(self):
+        # Returns the local field at every site at once
+        s = self.state
+        return np.roll(s, 1, 0) + np.roll(s, -1, 0) + np.roll(s, 1, 1) + np.roll(s, -1, 1)
+
+    def _random_sites(self, N):
+        # Row and column indices of N sites to update, drawn uniformly
+        return self.rng.randint(self.rows, size=N), self.rng.randint(self.cols, size=N)
+
+    def gibbs(self, N):
+        # Runs Gibbs sampling over the ising model N times.
+        # In Gibbs sampling, a random spin is selected.  The local field is calculated as
+        # the sum over the neighboring spins plus an external field
+        spins_i, spins_j = self._random_sites(N)
+        self._single_spin(spins_i, spins_j, 'gibbs')
+
+    def metropolis(self, N):
+        # Runs Metropolis sampling over the Ising model N times.
+        # In Metropolis sampling a spin is selected and the change in energy from flipping the spin is calculated.
+        # The change is accepted if the energy difference is negative and accepted with a probability equal to the ratio
+        # of the Boltzmann factors of the two states if it is positive
+        spins_i, spins_j = self._random_sites(N)
+        self._single_spin(spins_i, spins_j, 'metropolis')
+
+    def _single_spin(self, spins_i, spins_j, method):
+        # Updates the spins at (spins_i[n], spins_j[n]) in turn, adding the energy and magnetization
+        # change of every accepted flip to the running totals.  The loop runs compiled with the numba
+        # backend and in Python otherwise; both draw the same random numbers from self.rng, so a seeded
+        # model gives the same result either way.
+        if self.backend == 'numba' and _single_spin_jit is not None:
+            loop = _single_spin_jit
+        else:
+            loop = _single_spin_loop
+        table = self._table(method)
+        spins_i = np.asarray(spins_i, dtype=np.int64)
+        spins_j = np.asarray(spins_j, dtype=np.int64)
+        r = self.rng.rand(spins_i.size)
+
+        # stop the loop at every measurement to be recorded
+        start = 0
+        while start < spins_i.size:
+            stop = spins_i.size
+            if self.history is not None:
+                stop = min(stop, start + self._every - self._steps % self._every)
+            dE, dM = loop(self._state, spins_i[start:stop], spins_j[start:stop], r[start:stop],
+                          table, method == 'gibbs')
+            self._E += dE
+            self._M += dM
+            if self.history is not None:
+                self._steps += stop - start
+                if self._steps % self._every == 0:
+                    self._log()
+            start = stop
+        self._labels = None
+
+    def sweep(self, n_sweeps=1, method='gibbs'):
+        """
+        Runs n_sweeps sweeps of Gibbs or Metropolis sampling over the whole lattice.
+
+        The lattice is split into sublattices that share no bonds (the two colors of a
+        checkerboard, with an odd final row or column split off so that periodic boundaries
+        do not couple a sublattice to itself).  Every spin on a sublattice sees a frozen
+        neighborhood, so updating them all at once is the same as updating them one at a
+        time and each sublattice update keeps detailed balance.  A sweep visits every site
+        once, the same amount of work as gibbs(self.sites) or metropolis(self.sites).
+
+        The acceptance probabilities only depend on the local field, which takes one of
+        five values, so they are looked up from a table computed once per temperature.
+        """
+        table = self._table(method)
+        masks = self._sublattices()
+        for n in range(n_sweeps):
+            for mask in masks:
+                s = self.state[mask]
+                b = self.local_fields()[mask]
+                r = self.rng.rand(s.size)
+                if method == 'gibbs':
+                    # table holds the probability of spin up for b = -4, -2, 0, 2, 4
+                    new = np.where(r < table[((b + 4) // 2).astype(int)], 1, -1)
+                else:
+                    # table holds the flip probability for s * b = -4, -2, 0, 2, 4
+                    new = np.where(r < table[((s * b + 4) // 2).astype(int)], -s, s)
+                self.state[mask] = new
+                # no two sites of a sublattice are bonded, so the changes simply add up
+                self._E += np.sum((s - new) * b)
+                self._M += np.sum(new - s)
+            self._log()
+        self._labels = None
+
+    def _table(self, method):
+        # Acceptance probabilities at the current temperature, indexed by (b + 4) / 2
+        key = (method, self.temp)
+        if key not in self._tables:
+            self._tables[key] = _acceptance(method, self.temp)
+        return self._tables[key]
+
+    def _sublattices(self):
+        if self._masks is None:
+            self._masks = [mask & ~self._clamped for mask in _sublattices(self.state.shape)]
+        return self._masks
+
+    def wolff(self, N):
+        """
+        Runs N Wolff cluster updates.  Starting from a random site, the cluster grows across each bond
+        between equal spins with probability 1 - exp(-2 / T) and is then flipped as a whole.  Clusters
+        reaching a clamped site are left unflipped.  Near T_c a single update flips a finite fraction of
+        the lattice, so far fewer updates are needed between independent samples than with gibbs or
+        metropolis.  Returns the size of each cluster.
+        """
+        if self._nbrs is None:
+            self._nbrs = _neighbor_table(self.state.shape)
+        p = 1. - np.exp(-2. / self.temp)
+        state = self.state.ravel()
+        clamped = self._clamped.ravel()
+        free = np.flatnonzero(~clamped)
+        sizes = np.zeros(N, dtype=int)
+        # allocated once and cleared site by site, so an update costs O(cluster size) rather than O(sites)
+        in_cluster = np.zeros(self.sites, dtype=bool)
+
+        for n in range(N):
+            seed = free[self.rng.randint(free.size)]
+            spin = int(state[seed])
+            in_cluster[seed] = True
+            border = np.array([seed])
+            added = [border]
+            # every bond from a newly added site to the outside is tried exactly once
+            while border.size:
+                nbrs = self._nbrs[border].ravel()
+                nbrs = nbrs[(state[nbrs] == spin) & ~in_cluster[nbrs]]
+                border = np.unique(nbrs[self.rng.rand(nbrs.size) < p])
+                in_cluster[border] = True
+                added.append(border)
+            cluster = np.concatenate(added)
+            sizes[n] = cluster.size
+            if not clamped[cluster].any():
+                # only the bonds leaving the cluster change sign
+                outside = self._nbrs[cluster].ravel()
+                outside = outside[~in_cluster[outside]]
+                self._E += 2 * spin * np.sum(state[outside])
+                self._M -= 2 * spin * cluster.size
+                state[cluster] = -spin
+            in_cluster[cluster] = False
+            self._log()
+        # assigning _state directly keeps the running totals instead of recounting
+        self._state = state.reshape(self.state.shape)
+        self._labels = None
+        return sizes
+
+    def swendsen_wang(self, N):
+        """
+        Runs N Swendsen-Wang updates.  Each bond between equal spins is occupied with probability
+        1 - exp(-2 / T), the clusters of occupied bonds are labelled with a vectorized union-find, and every
+        cluster is flipped with probability 1/2.  Clusters containing a clamped site are never flipped.
+        """
+        if self._nbrs is None:
+            self._nbrs = _neighbor_table(self.state.shape)
+        p = 1. - np.exp(-2. / self.temp)
+        site = np.arange(self.sites)
+        right = self._nbrs[:, 1]
+        down = self._nbrs[:, 3]
+
+        for n in range(N):
+            s = self.state.ravel()
+            bond_r = (s == s[right]) & (self.rng.rand(self.sites) < p)
+            bond_d = (s == s[down]) & (self.rng.rand(self.sites) < p)
+            labels = _union_find(self.sites,
+                                 np.concatenate((site[bond_r], site[bond_d])),
+                                 np.concatenate((right[bond_r], down[bond_d])))
+            flip = self.rng.rand(self.sites) < 0.5
+            flip[labels[self._clamped.ravel()]] = False
+            self.state = np.where(flip[labels], -s, s).reshape(self.state.shape)
+            self._log()
+
+    def gibbs_display(self, N):
+        # Runs Gibbs sampling N times.  Every time it iterates the same number of times as the number of sites,
+        # it stores the energy in an array that it displays afterward.  Early on the energy should trend toward
+        # the equilibrium value and we will know we have run enough samples when it stabilizes.
+        self.randomize()
+        self._display_run(self.gibbs, N)
+
+    def metropolis_display(self, N):
+        # Same as gibbs_display above
+        if self.temp < 2:
+            self.ground_state()
+        else:
+            self.randomize()
+        self._display_run(self.metropolis, N)
+
+    def _display_run(self, sampler, N):
+        # Runs sampler(N) while recording the energy every self.sites steps and plots it
+        import matplotlib.pyplot as plt
+        saved = self.history, self._every, self._steps
+        self.record(N // self.sites + 1)
+        sampler(N)
+        E = self.history.values()[:, 0]
+        self.history, self._every, self._steps = saved
+        fig, ax = plt.subplots()
+        ax.plot(E)
+
+    def display(self):
+        import matplotlib.pyplot as plt
+        plt.imshow(self.state, cmap='Greys', interpolation='nearest')
+
+    def energy(self):
+        return self._E
+
+    def magnetization(self):
+        return self._M
+
+    def _update(self, method):
+        # Returns a function running one update of the named sampler: a sweep for 'gibbs' and 'metropolis',
+        # a single cluster update for 'wolff' and 'swendsen_wang'
+        if method in ('gibbs', 'metropolis'):
+            return lambda: self.sweep(1, method)
+        elif method == 'wolff':
+            return lambda: self.wolff(1)
+        elif method == 'swendsen_wang':
+            return lambda: self.swendsen_wang(1)
+        raise ValueError("unknown sampling method '%s'" % method)
+
+    def energy_stat(self, err=0.001, method='gibbs', n_init=100, max_samples=100000):
+        """
+        E_mean, E_var, E = model.energy_stat(err=0.001, method='gibbs', n_init=100, max_samples=100000)
+
+        Equilibrates the model with n_init updates and then measures the energy after every update
+        until the standard error of the mean energy per site, corrected for the autocorrelation of the
+        chain, is at most err.  Points far from T_c decorrelate quickly and stop early while points near
+        T_c run longer.  Returns the mean and variance of the energy and the array of measurements.
+        """
+        # Initialize the system depending on the temperature
+        if self.temp < 1.75:
+            self.ground_state()
+        else:
+            self.randomize()
+        update = self._update(method)
+        for n in range(n_init):
+            update()
+        est, E = run_until(update, self.energy, err * self.sites, max_samples=max_samples)
+        return float(est.mean), float(est.var()), E
+
+    def magnetization_stat(self, num_meas=None, err=0.001, method='gibbs', n_init=200, n_sample=50,
+                           max_samples=100000):
+        """
+        M_mean, M_var, M = model.magnetization_stat(num_meas=None, err=0.001, method='gibbs', n_init=200,
+                                                    n_sample=50)
+
+        Same as energy_stat for the magnetization, starting from the ground state.  If num_meas is
+        given exactly that many measurements are taken instead, n_sample updates apart so that they are
+        close to independent.
+        """
+        self.ground_state()
+        update = self._update(method)
+        for n in range(n_init):
+            update()
+        if num_meas is None:
+            est, M = run_until(update, self.magnetization, err * self.sites, max_samples=max_samples)
+        else:
+            def spaced_update():
+                for n in range(n_sample):
+                    update()
+            est, M = run_until(spaced_update, self.magnetization, 0, min_samples=num_meas,
+                               max_samples=num_meas)
+        return float(est.mean), float(est.var()), M
+
+    def cluster_labels(self):
+        """
+        Returns an array labelling every site with the cluster of equal, connected spins it belongs to,
+        taking the periodic boundaries into account.  The label of a cluster is the smallest flat index
+        among its sites.  The labels are computed in one pass with a vectorized union-find and kept
+        until the state changes.
+        """
+        if self._labels is None:
+            if self._nbrs is None:
+                self._nbrs = _neighbor_table(self.state.shape)
+            s = self.state.ravel()
+            site = np.arange(self.sites)
+            right = self._nbrs[:, 1]
+            down = self._nbrs[:, 3]
+            bond_r = s == s[right]
+            bond_d = s == s[down]
+            labels = _union_find(self.sites,
+                                 np.concatenate((site[bond_r], site[bond_d])),
+                                 np.concatenate((right[bond_r], down[bond_d])))
+            self._labels = labels.reshape(self.state.shape)
+        return self._labels
+
+    def cluster_sizes(self):
+        # Returns the size of every cluster of the current state
+        counts = np.bincount(self.cluster_labels().ravel(), minlength=self.sites)
+        return counts[counts > 0]
+
+    def cluster_size_distribution(self):
+        # Returns n where n[k] is the number of clusters of k spins
+        return np.bincount(self.cluster_sizes(), minlength=self.sites + 1)
+
+    def is_connected(self, site1, site2):
+        """
+        Returns True if the nodes at the two indices are connected to the same cluster and False otherwise
+        """
+        labels = self.cluster_labels()
+        return bool(labels[tuple(site1)] == labels[tuple(site2)])
+
+class Ising_cs(Ising):
+    # Implements an Ising model with a region set to a particular state.
+    # Data stored by the model are:
+    # state - the current state of the model stored as a numpy array
+    # signal - a list or array of the signal set into the ising model (should be +/-1s)
+    # fixed - a list of tuples containing the indices of the signal
+    # free_idx - the flat indices of the sites not fixed by the model
+    # free - the same as a list of (i, j) tuples
+    # temp - the temperature of the model
+    # rows
+    # cols
+    def __init__(self, shape, signal_vec, fixed_idxs, T, seed=None):
+        # initialize the state to a random array
+        Ising.__init__(self, shape, T, seed=seed)
+        # set signal and place in the state array
+        self.signal = signal_vec
+        self.fixed = fixed_idxs
+        self._fixed_idx = np.array([i * self.cols + j for (i, j) in self.fixed], dtype=int)
+        self._clamped.flat[self._fixed_idx] = True
+        self._set_signal()
+        # free indices are those that are not fixed
+        self.free_idx = np.flatnonzero(~self._clamped)
+
+    @property
+    def free(self):
+        i, j = np.unravel_index(self.free_idx, self.state.shape)
+        return list(zip(i.tolist(), j.tolist()))
+
+    def _set_signal(self):
+        self.state.flat[self._fixed_idx] = self.signal
+        self._recount()
+
+    def new_state(self, newstate):
+        Ising.new_state(self, newstate)
+        self._set_signal()
+
+    def randomize(self):
+        Ising.randomize(self)
+        self._set_signal()
+
+    def ground_state(self):
+        Ising.ground_state(self)
+        self._set_signal()
+
+    def _random_sites(self, N):
+        # Only the free spins are updated
+        sites = self.free_idx[self.rng.randint(self.free_idx.size, size=N)]
+        return sites // self.cols, sites % self.cols
+
+    def display_signal(self, rec):
+        # Displays the signal spins in light grey and the recording spin in black
+        import matplotlib.pyplot as plt
+        rec_i, rec_j = rec
+        sig_display = np.zeros(self.state.shape)
+        sig_display.flat[self._fixed_idx] = 0.5
+        sig_display[rec_i, rec_j] = 1
+        plt.imshow(sig_display, cmap='Greys', interpolation='nearest')
+
+    def _flat(self, sites):
+        # Flat indices of a list of (i, j) sites
+        sites = np.asarray(sites, dtype=int).reshape(-1, 2)
+        return sites[:, 0] % self.rows * self.cols + sites[:, 1] % self.cols
+
+    def measurement_matrix(self, recs, out=None):
+        """
+        Returns an int8 matrix with a row for each recording site in recs and a column for each signal spin,
+        holding 1 where the two are connected to the same cluster and 0 otherwise.  The rows are gathered
+        from the cluster labels in one step; out may be a preallocated (len(recs), len(fixed)) int8 array.
+        """
+        labels = self.cluster_labels().ravel()
+        if out is None:
+            out = np.empty((len(recs), self._fixed_idx.size), dtype=np.int8)
+        np.equal(labels[self._flat(recs)][:, None], labels[self._fixed_idx][None, :], out=out, casting='unsafe')
+        return out
+
+    def vote_matrix(self, recs, out=None):
+        """
+        Returns an int8 matrix with a row for each recording site in recs holding the value of the recording
+        spin for each signal spin connected to it and 0 elsewhere.  out may be a preallocated int8 array.
+        """
+        out = self.measurement_matrix(recs, out)
+        out *= self.state.ravel()[self._flat(recs)][:, None].astype(np.int8)
+        return out
+
+    def votes(self, recs, num_samples, n_sweeps=200, method='gibbs'):
+        """
+        Generator yielding the vote matrix of recs for num_samples independent states, each sampled by
+        randomizing the model and running n_sweeps sweeps.  The same preallocated array is filled and
+        yielded every time, so feed it to a MajorityVote (or copy it) before asking for the next one.
+        """
+        out = np.empty((len(recs), self._fixed_idx.size), dtype=np.int8)
+        for n in range(num_samples):
+            self.randomize()
+            self.sweep(n_sweeps, method)
+            yield self.vote_matrix(recs, out)
+
+    def measurement_vec(self, rec):
+        """
+        Returns a vector expressing the dependence of the recording spin at rec_i, rec_j on each of the spins in
+        signal.  This dependence is a 1 if they are connected to the same cluster and 0 otherwise and the vectors
+        are l1 normalized
+        """
+        measurement_vec = np.zeros_like(self.signal)
+        measurement_vec[:] = self.measurement_matrix([rec])[0]
+        s = sum(measurement_vec)
+        if s != 0:
+            measurement_vec = measurement_vec / float(s)
+        return measurement_vec
+
+    def vote_vec(self, rec):
+        """
+        Returns a vector containing the value of the recording spin if the signal spin coupled to the recording
+        spin
+        """
+        return self.vote_matrix([rec])[0]
+
+
+class MajorityVote(object):
+    # Accumulates votes for each signal spin without storing the vote matrix.
+    # Data stored are:
+    # pos, neg - the number of +1 and -1 votes cast for each signal spin so far
+    def __init__(self, n):
+        self.pos = np.zeros(n, dtype=int)
+        self.neg = np.zeros(n, dtype=int)
+
+    def add(self, votes):
+        # Adds a vote vector or the rows of a vote matrix
+        votes = np.asarray(votes).reshape(-1, self.pos.size)
+        self.pos += np.sum(votes == 1, axis=0)
+        self.neg += np.sum(votes == -1, axis=0)
+
+    def result(self):
+        # Same as reconstruct_majority_vote on all the votes added so far
+        return np.greater(self.pos, self.neg) + -1 * np.greater(self.neg, self.pos)
+
+
+def reconstruct_majority_vote(vote_mat):
+    """
+    Returns a vector of the modes of (the nonzero entries which are either 1 or -1 of) each column of the vote_matrix
+    In the event of a tie, it returns 0
+    """
+    pos_vote = np.sum(vote_mat == 1, axis=0)
+    neg_vote = np.sum(vote_mat == -1, axis=0)
+    return np.greater(pos_vote, neg_vote) + -1 * np.greater(neg_vote, pos_vote)
+
+
+def generate_circular_indices(center, radius, num):
+    """
+    Returns a list of tuples containing the indices lying in a circle around the center spin
+    """
+    thetas = np.linspace(0, 2 * np.pi, int(num), endpoint=False)
+    i = center[0] + (radius * np.cos(thetas)).astype(int)
+    j = center[1] + (radius * np.sin(thetas)).astype(int)
+    return list(zip(i.tolist(), j.tolist()))
+
+class IsingEnsemble(object):
+    # Implements a set of replicas of the Ising model, one per temperature, that are advanced together
+    # and exchange states between neighboring temperatures (parallel tempering).
+    # Data stored by the model are:
+    # state - a (replicas, rows, cols) int8 array holding the state of each replica
+    # temps - the temperature of each replica, in increasing or decreasing order
+    # attempts, accepts - the number of proposed and accepted swaps between temps[k] and temps[k + 1]
+    def __init__(self, shape, temps, init=None, seed=None):
+        # with a seed the ensemble draws from its own random number generator, as Ising
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        self.temps = np.asarray(temps, dtype=float)
+        self.replicas = self.temps.size
+        if init is None:
+            self.state = _random_spins((self.replicas,) + tuple(shape), self.rng)
+        else:
+            self.state = np.asarray(init, dtype=np.int8)
+            if self.state.shape != (self.replicas,) + tuple(shape):
+                raise ValueError("init must have shape (len(temps),) + shape")
+        self.rows = self.state.shape[1]
+        self.cols = self.state.shape[2]
+        self.sites = self.rows * self.cols
+
+        self.attempts = np.zeros(self.replicas - 1, dtype=int)
+        self.accepts = np.zeros(self.replicas - 1, dtype=int)
+        self._masks = _sublattices((self.rows, self.cols))
+        self._parity = 0
+
+    def randomize(self):
+        self.state = _random_spins(self.state.shape, self.rng)
+
+    def ground_state(self):
+        self.state = -np.ones(self.state.shape, dtype=np.int8)
+
+    def snapshot(self):
+        # Returns a (replicas, bytes) array of the packed states, see pack_state
+        return pack_state(self.state)
+
+    def local_fields(self):
+        # Returns the local field at every site of every replica
+        s = self.state
+        return np.roll(s, 1, 1) + np.roll(s, -1, 1) + np.roll(s, 1, 2) + np.roll(s, -1, 2)
+
+    def energies(self):
+        # Returns the energy of each replica
+        s = self.state
+        return -np.sum(s * (np.roll(s, 1, 1) + np.roll(s, 1, 2)), axis=(1, 2))
+
+    def magnetizations(self):
+        return np.sum(self.state, axis=(1, 2))
+
+    def sweep(self, n_sweeps=1, method='gibbs'):
+        """
+        Runs n_sweeps checkerboard sweeps over every replica at its own temperature.  See Ising.sweep.
+        """
+        # flatten the (replica, field) lookup so one gather serves all temperatures
+        table = _acceptance(method, self.temps).ravel()
+        offset = 5 * np.arange(self.replicas)[:, None]
+        for n in range(n_sweeps):
+            for mask in self._masks:
+                s = self.state[:, mask]
+                b = self.local_fields()[:, mask]
+                r = self.rng.rand(*s.shape)
+                if method == 'gibbs':
+                    self.state[:, mask] = np.where(r < table[offset + (b + 4) // 2], 1, -1)
+                else:
+                    self.state[:, mask] = np.where(r < table[offset + (s * b + 4) // 2], -s, s)
+
+    def exchange(self):
+        """
+        Proposes swapping the states of neighboring temperatures, alternating between the pairs
+        (0, 1), (2, 3), ... and (1, 2), (3, 4), ... on successive calls.  A swap is accepted with
+        probability min(1, exp((1/T_k - 1/T_k+1) * (E_k - E_k+1))), which leaves the joint
+        distribution of all replicas unchanged.
+        """
+        E = self.energies()
+        beta = 1. / self.temps
+        k = np.arange(self._parity, self.replicas - 1, 2)
+        self._parity = 1 - self._parity
+
+        log_acc = (beta[k] - beta[k + 1]) * (E[k] - E[k + 1])
+        accept = self.rng.rand(k.size) < np.exp(np.minimum(log_acc, 0))
+        self.attempts[k] += 1
+        self.accepts[k[accept]] += 1
+
+        k = k[accept]
+        self.state[np.concatenate((k, k + 1))] = self.state[np.concatenate((k + 1, k))]
+
+    def run(self, n_sweeps, method='gibbs', swap_every=1):
+        # Runs n_sweeps sweeps, proposing replica exchanges after every swap_every sweeps
+        for n in range(n_sweeps):
+            self.sweep(1, method)
+            if (n + 1) % swap_every == 0:
+                self.exchange()
+
+    def acceptance(self):
+        # Fraction of accepted swaps between temps[k] and temps[k + 1]
+        return self.accepts / np.maximum(self.attempts, 1).astype(float)
+
+    def energy_stat(self, num_meas=None, err=0.001, n_init=200, n_sample=1, method='gibbs', swap_every=1,
+                    max_samples=100000):
+        """
+        E_means, E_vars, E = ensemble.energy_stat(num_meas=None, err=0.001, n_init=200, n_sample=1)
+
+        Equilibrates the ensemble for n_init sweeps then records the energy of every replica every
+        n_sample sweeps, until the standard error of the mean energy per site is at most err at every
+        temperature (or num_meas times if it is given).  Returns the mean and variance of the energy at
+        each temperature along with the (samples, replicas) array of measurements, giving a whole
+        E_means/E_vars curve over temps from a single run.
+        """
+        self.run(n_init, method, swap_every)
+        update = lambda: self.run(n_sample, method, swap_every)
+        if num_meas is None:
+            est, E = run_until(update, self.energies, err * self.sites, max_samples=max_samples)
+        else:
+            est, E = run_until(update, self.energies, 0, min_samples=num_meas, max_samples=num_meas)
+        return est.mean, est.var(), E
+
+
+def _bernoulli_words(p, shape, rng=np.random, bits=24):
+    # uint64 words whose bits are independently 1 with probability p, rounded down to a multiple of
+    # 2**-bits.  Working up from the last binary digit of p, a digit of 1 ORs in a word of fair random
+    # bits and a digit of 0 ANDs one in, which sets a bit exactly when a uniform random fraction falls
+    # below p.
+    digits = int(p * 2 ** bits)
+    words = np.zeros(shape, dtype=np.uint64)
+    for k in range(bits):
+        r = np.frombuffer(rng.bytes(8 * words.size), dtype=np.uint64).reshape(shape)
+        if (digits >> k) & 1:
+            words = words | r
+        else:
+            words = words & r
+    return words
+
+
+class MultiSpinIsing(object):
+    # Implements many replicas of the Ising model at a single temperature with multi-spin coding: bit r of
+    # words[w, i, j] holds the spin of replica 64 * w + r at (i, j), 1 for up.  A Metropolis sweep updates
+    # all 64 replicas in a word with a few bitwise operations per site, so thousands of 128x128 replicas fit
+    # in memory and update at once.
+    # Data stored by the model are:
+    # words - a (replicas / 64, rows, cols) uint64 array of spins
+    # temp - the temperature of the model
+    # replicas, rows, cols
+    def __init__(self, shape, T, replicas=64, seed=None):
+        if replicas % 64:
+            raise ValueError("replicas must be a multiple of 64")
+        # with a seed the model draws from its own random number generator, as Ising
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        self.replicas = replicas
+        self.rows, self.cols = shape
+        self.sites = self.rows * self.cols
+        self.temp = T
+        self.randomize()
+        self._masks = _sublattices(shape)
+
+    def randomize(self):
+        n = self.replicas // 64 * self.sites
+        self.words = np.frombuffer(self.rng.bytes(8 * n), dtype=np.uint64).reshape(-1, self.rows, self.cols).copy()
+
+    def ground_state(self):
+        self.words = np.zeros((self.replicas // 64, self.rows, self.cols), dtype=np.uint64)
+
+    def sweep(self, n_sweeps=1):
+        """
+        Runs n_sweeps Metropolis sweeps over every replica.  With k the number of neighbors antiparallel to a
+        spin, flipping it changes the energy by 8 - 4k.  Flips with k >= 2 are always accepted, k = 1 with
+        probability exp(-4 / T) and k = 0 with probability exp(-8 / T), the product of two independent
+        draws at exp(-4 / T).
+        """
+        p = np.exp(-4. / self.temp)
+        for n in range(n_sweeps):
+            for mask in self._masks:
+                w = self.words
+                s = w[:, mask]
+                x1 = s ^ np.roll(w, 1, 1)[:, mask]
+                x2 = s ^ np.roll(w, -1, 1)[:, mask]
+                x3 = s ^ np.roll(w, 1, 2)[:, mask]
+                x4 = s ^ np.roll(w, -1, 2)[:, mask]
+                # at least two antiparallel neighbors, and at least one
+                ge2 = (x1 & x2) | (x3 & x4) | ((x1 ^ x2) & (x3 ^ x4))
+                ge1 = x1 | x2 | x3 | x4
+                a1 = _bernoulli_words(p, s.shape, self.rng)
+                a2 = _bernoulli_words(p, s.shape, self.rng)
+                self.words[:, mask] = s ^ (ge2 | (a1 & (ge1 | a2)))
+
+    def states(self):
+        # Returns the (replicas, rows, cols) int8 array of spins
+        bits = (self.words[:, None] >> np.arange(64, dtype=np.uint64)[None, :, None, None]) & np.uint64(1)
+        return (2 * bits.astype(np.int8) - 1).reshape(self.replicas, self.rows, self.cols)
+
+    def energies(self):
+        # Returns the energy of each replica
+        s = self.states()
+        return -np.sum(s * (np.roll(s, 1, 1) + np.roll(s, 1, 2)), axis=(1, 2))
+
+    def magnetizations(self):
+        return np.sum(self.states(), axis=(1, 2))
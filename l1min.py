@@ -9,7 +9,7 @@
 #
 
 
-from cvxopt import matrix,solvers
+from cvxopt import matrix,spmatrix,sparse,solvers
 
 
 # l1m(A, b, e) solves the following convex optimization problem using CVXOPT
@@ -54,10 +54,7 @@ def rl1m_lp(A, m, n, b):
 	c[n:2*n] = 1.0
 	Aa = matrix(0.0, (m,2*n))
 	Aa[:,0:n] = A		
-	G = matrix(0.0, (3*n,2*n))
-	for i in range(n):
-		G[i,i] = 1.0
-		G[n+i,i] = G[i,n+i] = G[n+i,n+i] = G[2*n+i,n+i] = -1.0
+	G = l1_constraints(n)
 	h = matrix(0.0, (3*n,1))
 	sol = solvers.lp(c, G, h, Aa, b)
 	s = sol['x']
@@ -74,10 +71,7 @@ def rl1m_lp(A, m, n, b):
 def rl1m_socp(A, m, n, b, e):
 	c = matrix(0.0, (2*n,1))
 	c[n:2*n] = 1.0
-	Gl = matrix(0.0, (3*n,2*n))
-	for i in range(n):
-		Gl[i,i] = 1.0
-		Gl[n+i,i] = Gl[i,n+i] = Gl[n+i,n+i] = Gl[2*n+i,n+i] = -1.0
+	Gl = l1_constraints(n)
 	hl = matrix(0.0, (3*n,1))
 	Gq = []
 	hq = []
@@ -93,6 +87,23 @@ def rl1m_socp(A, m, n, b, e):
 	return s[0:n]
 
 
+# l1_constraints: builds the sparse 3n by 2n matrix G of the linear
+# inequalities G*[x;u] <= 0 used by the real solvers, which are
+#
+#        x - u <= 0,   -x - u <= 0,   -u <= 0
+#
+# so that minimizing sum(u) minimizes |x|_1. The five diagonals are given as
+# index lists all at once instead of filling in a dense matrix.
+
+def l1_constraints(n):
+	r = list(range(n))
+	rn = list(range(n,2*n))
+	I = r + rn + r + rn + list(range(2*n,3*n))
+	J = r + r + rn + rn + rn
+	V = [1.0]*n + [-1.0]*(4*n)
+	return spmatrix(V, I, J, (3*n,2*n))
+
+
 # cl1m_socp: solves the following second order cone program
 #
 #       minimize |x|_1   subject to   |Ax-b|_2 <= e
@@ -102,17 +113,18 @@ def rl1m_socp(A, m, n, b, e):
 # is transformed to
 #
 #       minimize |x|_1   subject to   Ax = b
+#
+# Each [u_i; Re x_i; Im x_i] must lie in a second order cone of size 3. The
+# constraint matrix of all n cones together is just -I, so they are given to
+# the cone solver as one sparse block of n cones of size 3 (plus one more cone
+# of size 2m+1 when e>0) instead of n separate dense matrices.
 
 def cl1m_socp(A, m, n, b, e):
 	c = matrix(0.0, (3*n,1))
 	c[range(0,3*n,3)] = 1.0
-	Ga=[]
-	ha=[]
-	for i in range(n):
-	    G = matrix(0.0, (3,3*n))
-	    G[0,3*i] = G[1,3*i+1] = G[2,3*i+2] = -1.0
-	    Ga.append(G)
-	    ha.append(matrix(0.0,(3,1)))
+	G = spmatrix(-1.0, range(3*n), range(3*n))
+	h = matrix(0.0, (3*n,1))
+	dims = {'l': 0, 'q': [3]*n, 's': []}
 	sol = None
 	Aa = matrix(0.0, (2*m,3*n))
 	Aa[0:m,range(1,3*n,3)] = A.real()
@@ -123,20 +135,17 @@ def cl1m_socp(A, m, n, b, e):
 	y[0:m] = b.real()
 	y[m:2*m] = b.imag()
 	if e==0:
-		sol = solvers.socp(c, Gq=Ga, hq=ha, A=Aa, b=y)
+		sol = solvers.conelp(c, G, h, dims, A=Aa, b=y)
 	else:
-		G = matrix(0.0, (2*m+1,3*n))
-		G[1:2*m+1,:] = Aa
-		Ga.append(G)
-		h = matrix(0.0, (2*m+1,1))
-		h[0] = e
-		h[1:2*m+1] = y
-		ha.append(h)
-		sol = solvers.socp(c, Gq=Ga, hq=ha)
+		Ge = matrix(0.0, (2*m+1,3*n))
+		Ge[1:2*m+1,:] = Aa
+		he = matrix(0.0, (2*m+1,1))
+		he[0] = e
+		he[1:2*m+1] = y
+		dims['q'].append(2*m+1)
+		sol = solvers.conelp(c, sparse([G, Ge]), matrix([h, he]), dims)
 	s = sol['x']
-	z = matrix(complex(0,0),(n,1))
-	for i in range(n): z[i] = complex(s[3*i+1], s[3*i+2])
-	return z
+	return s[range(1,3*n,3)] + 1j*s[range(2,3*n,3)]
 
 
 __all__ = ['l1m']
@@ -0,0 +1,169 @@
+"""
+Streaming statistics for correlated Monte Carlo samples.
+
+Successive states of a Markov chain are correlated, so the naive standard
+error of a mean taken over them is too small.  Estimator keeps a running
+mean and variance along with a binary blocking analysis (Flyvbjerg and
+Petersen 1989): samples are averaged in blocks of 1, 2, 4, ... and the
+standard error of the mean is read off once the blocks are long enough to
+be independent.  Everything is updated one sample at a time in O(log n)
+memory, so sampling can stop as soon as the requested error is reached.
+
+While the blocks are shorter than the autocorrelation time every blocking
+level underestimates the error, so an error is only trusted once the
+estimates from the longest blocks have levelled off (plateaued()).
+"""
+
+import numpy as np
+
+
+class Estimator(object):
+    # Running statistics of a stream of samples, each a scalar or an array of a fixed shape.
+    # Data stored are:
+    # n - the number of samples seen
+    # mean - the running mean
+    # min_blocks - the fewest blocks a blocking level needs to be used in the error estimate
+    def __init__(self, min_blocks=32):
+        self.min_blocks = min_blocks
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+        self._shift = None
+        # blocking levels: [count, sum, sum of squares] of the block means of length 2**k, and the
+        # block mean still waiting for its partner at each level
+        self._levels = []
+        self._pending = []
+
+    def add(self, x):
+        x = np.array(x, dtype=float)
+        if self.n == 0:
+            self.mean = np.zeros(x.shape)
+            self._m2 = np.zeros(x.shape)
+            # sums are taken relative to the first sample so the squares do not lose precision
+            self._shift = x.copy()
+        # Welford update of the mean and variance
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+        x = x - self._shift
+        level = 0
+        while True:
+            if level == len(self._levels):
+                self._levels.append([0, np.zeros(x.shape), np.zeros(x.shape)])
+                self._pending.append(None)
+            stats = self._levels[level]
+            stats[0] += 1
+            stats[1] += x
+            stats[2] += x * x
+            if self._pending[level] is None:
+                self._pending[level] = x
+                break
+            x = 0.5 * (self._pending[level] + x)
+            self._pending[level] = None
+            level += 1
+
+    def extend(self, xs):
+        for x in xs:
+            self.add(x)
+
+    def var(self):
+        # Variance of the samples
+        if self.n < 2:
+            return np.full_like(self.mean, np.nan) if self.n else np.nan
+        return self._m2 / (self.n - 1)
+
+    def block_errors(self):
+        # Standard error of the mean estimated from each blocking level with at least two blocks
+        errs = []
+        for count, total, squares in self._levels:
+            if count < 2:
+                break
+            block_var = (squares - total * total / count) / (count - 1)
+            errs.append(np.sqrt(np.maximum(block_var, 0) / count))
+        return np.array(errs)
+
+    def stderr(self):
+        """
+        Standard error of the mean.  The blocking estimate grows with the block length until the blocks
+        are longer than the correlation time and then levels off; the largest estimate over the levels
+        with at least min_blocks blocks is taken.  With too few samples for any such level the estimate
+        from the longest blocks available is returned.
+        """
+        errs = self.block_errors()
+        if not len(errs):
+            return np.full_like(self.mean, np.inf) if self.n else np.inf
+        counts = np.array([stats[0] for stats in self._levels[:len(errs)]])
+        usable = counts >= self.min_blocks
+        if not usable.any():
+            return errs[-1]
+        return np.max(errs[usable], axis=0)
+
+    def tau(self):
+        # Integrated autocorrelation time in samples, from stderr**2 = 2 * tau * var / n
+        var = self.var()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau = self.n * self.stderr() ** 2 / (2. * var)
+        return np.where(var > 0, tau, 0.5)
+
+    def plateaued(self, n_tau=50):
+        """
+        True once the blocking estimate has levelled off.  Following Lee, Needs and Towler (2011), a
+        level with blocks of length B is long enough once B**3 > 2 n (err_B / err_1)**4, where err_1 is
+        the naive error from single samples; (err_B / err_1)**2 approaches 2 tau, so this asks for
+        blocks much longer than the autocorrelation time.  While the blocks are shorter than tau,
+        (err_B / err_1)**2 grows like B and no level with min_blocks blocks can pass, however close
+        its errors are to each other.  There must also be at least n_tau autocorrelation times of
+        samples.
+        """
+        errs = self.block_errors()
+        if len(errs) < 2:
+            return False
+        counts = np.array([stats[0] for stats in self._levels[:len(errs)]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(errs[0] > 0, errs / errs[0], 1.)
+        B = 2. ** np.arange(len(errs)).reshape((-1,) + (1,) * (errs.ndim - 1))
+        ok = (B ** 3 > 2. * self.n * ratio ** 4) & (counts >= self.min_blocks).reshape(B.shape)
+        if not np.all(ok.any(axis=0)):
+            return False
+        return bool(np.all(self.n >= n_tau * self.tau()))
+
+    def converged(self, target):
+        # True once the error estimate has plateaued and it is at most target everywhere
+        return self.plateaued() and bool(np.all(self.stderr() <= target))
+
+
+def run_until(step, measure, target, min_samples=64, max_samples=100000, store=True):
+    """
+    est, samples = run_until(step, measure, target, min_samples=64, max_samples=100000, store=True)
+
+    Alternates calling step() and recording measure() until the standard error of the mean of the
+    measurements is at most target (elementwise for array measurements), at least min_samples have
+    been taken and the blocking estimate has plateaued (see Estimator.plateaued), or max_samples is
+    reached.  A chain whose autocorrelation time is too long for the error to plateau runs to
+    max_samples, and est.plateaued() is then False: its stderr() is a lower bound on the error.
+    Returns the Estimator and the array of measurements, which grows as they are taken.  With
+    store=False the measurements are not kept and samples is None, so only the Estimator's O(log n)
+    memory is used.
+    """
+    est = Estimator()
+    samples = None
+    n = 0
+    while n < max_samples:
+        step()
+        x = measure()
+        if store:
+            if samples is None:
+                samples = np.zeros((min(max_samples, 1024),) + np.shape(x))
+            elif n == len(samples):
+                # double the buffer, up to max_samples
+                grown = np.zeros((min(max_samples, 2 * n),) + samples.shape[1:])
+                grown[:n] = samples
+                samples = grown
+            samples[n] = x
+        est.add(x)
+        n += 1
+        if n >= min_samples and est.converged(target):
+            break
+    return est, samples[:n] if store else None
@@ -6,10 +6,8 @@ Written by Jeffrey Bush (jeff@coderforlife.com) 2010
 Adapted from UCSD Neurodynamics MATLAB clines package 
 """
 
-import pylab as plt
+import multiprocessing
 import scipy as sp
-import scipy.linalg as lin
-from scipy.interpolate import griddata # only available in SciPy 0.9 and later
 
 def getNullcline(d, x, y):
     """X,Y = getNullcline(d, x, y)
@@ -22,14 +20,219 @@ def getNullcline(d, x, y):
       y  : The y-values for the rows of f.
     
     Returns:
-     X,Y : The x and y values of the null-cline.
+     X,Y : The x and y values of the null-cline. If the null-cline has
+           several branches they are all returned, separated by NaNs. Closed
+           branches end with their first point.
+
+    The null-cline is found with marching squares: the points where it
+    crosses the edges of the grid are found by linear interpolation, each
+    grid cell joins the points on its edges with one or two segments, and
+    the segments are chained together into curves. Cells with a NaN corner
+    are skipped.
+    """
+    d = sp.asarray(d, dtype=float)
+    if d.ndim != 2:
+        raise ValueError('d must be a matrix, use getNullclines for a stack of them.')
+    X, Y, offsets = getNullclines(d[None], x, y)
+    return X, Y
+
+def getNullclines(d, x, y, processes=None):
+    """X,Y,offsets = getNullclines(d, x, y, processes=None)
+    getNullclines finds the null-clines of a stack of matrices all at once,
+    such as the same function evaluated on the same grid for each value of a
+    parameter. The null-cline of d[k] is X[offsets[k]:offsets[k+1]],
+    Y[offsets[k]:offsets[k+1]] and is the same as getNullcline(d[k], x, y).
+    
+    Parameters:
+      d  : A 3-D array, with d[k] a matrix approximating a two-dimensional
+           function.
+      x  : The x-values for the columns of each d[k].
+      y  : The y-values for the rows of each d[k].
+      processes : If given, the stack is split among this many processes.
+    
+    Returns:
+     X,Y : The x and y values of all of the null-clines one after another.
+     offsets : Where each null-cline starts in X and Y, with one extra value
+               at the end so the last null-cline is X[offsets[-2]:].
+    """
+    x, y = _grid_vectors(x, y)
+    d = sp.asarray(d, dtype=float)
+    if d.ndim != 3 or d.shape[1:] != (len(y), len(x)):
+        raise ValueError('d must be a stack of matrices with len(y) rows and len(x) columns.')
+    if processes is None or processes <= 1 or len(d) <= 1:
+        return _nullclines((d, x, y))
+
+    # Split the stack into about equal chunks and run each in its own process
+    bounds = sp.linspace(0, len(d), min(processes, len(d)) + 1).astype(int)
+    pool = multiprocessing.Pool(len(bounds) - 1)
+    try:
+        results = pool.map(_nullclines, [(d[a:b], x, y) for a, b in zip(bounds[:-1], bounds[1:])])
+    finally:
+        pool.close()
+        pool.join()
+    starts = sp.cumsum([0] + [len(X) for X, Y, offsets in results[:-1]])
+    X = sp.concatenate([X for X, Y, offsets in results])
+    Y = sp.concatenate([Y for X, Y, offsets in results])
+    offsets = sp.concatenate([offsets[:-1] + s for (X, Y, offsets), s in zip(results, starts)] + [[len(X)]])
+    return X, Y, offsets
+
+def _nullclines(args):
+    """X,Y,offsets = _nullclines((d, x, y))
+    Does the work of getNullclines, taking the arguments as a single tuple so
+    that it can be given to Pool.map.
+    """
+    d, x, y = args
+    n = d.shape[1]*(d.shape[2]-1) + (d.shape[1]-1)*d.shape[2] # edges per matrix
+    src, dst = _contour_segments(d)
+    idx = _trace(src, dst)
+
+    # _trace separates every curve from the next but there is no need for a
+    # separator between the last curve of one matrix and the first of the next
+    k = idx // n
+    sep = sp.nonzero(idx < 0)[0]
+    idx = sp.delete(idx, sep[k[sep-1] != k[sep+1]])
+    k = idx // n
+    k[idx < 0] = k[sp.nonzero(idx < 0)[0] - 1]
+    offsets = sp.searchsorted(k, sp.arange(len(d) + 1))
+
+    X, Y = sp.empty(len(idx)), sp.empty(len(idx))
+    X[idx < 0] = Y[idx < 0] = sp.nan
+    X[idx >= 0], Y[idx >= 0] = _edge_points(d, x, y, idx[idx >= 0])
+    return X, Y, offsets
+
+def _grid_vectors(x, y):
+    """x, y = _grid_vectors(x, y)
+    Returns the x-values of the columns and the y-values of the rows of a
+    grid, which can be given either directly as vectors or as the matrices
+    from meshgrid.
+    """
+    x, y = sp.asarray(x, dtype=float), sp.asarray(y, dtype=float)
+    if x.ndim == 2: x = x[0,:]
+    if y.ndim == 2: y = y[:,0]
+    return x, y
+
+def _contour_segments(d):
+    """src, dst = _contour_segments(d)
+    Finds the segments of the zero contour of each matrix in the stack d in
+    each cell of the grid. Segment k goes from the point on grid edge src[k]
+    to the point on grid edge dst[k], with the edges numbered as in
+    _edge_points.
+
+    The cells are handled all at once. The corners of a cell are numbered
+    counter-clockwise from the lower-left (0: d[r,c], 1: d[r,c+1],
+    2: d[r+1,c+1], 3: d[r+1,c]) and edge k of the cell goes from corner k to
+    corner k+1. Going counter-clockwise around the cell, the contour leaves
+    the positive region on some edges and enters it on others. Each segment
+    goes from a leaving edge to the next crossed edge, so the positive region
+    is always on its left. The two cells sharing an edge go around it in
+    opposite directions, so the point on that edge is the end of the segment
+    in one cell and the start of the segment in the other, and every point
+    starts at most one segment and ends at most one segment.
+
+    For saddle cells (all four edges crossed) the value in the center decides
+    whether the positive corners are joined or cut off from each other.
+    """
+    nr, nc = d.shape[1:]
+
+    # Only look at the cells the contour passes through
+    pos = d > 0
+    ok = ~sp.isnan(d)
+    ok = ok[:,:-1,:-1] & ok[:,:-1,1:] & ok[:,1:,1:] & ok[:,1:,:-1]
+    p = pos[:,:-1,:-1]
+    mixed = (p != pos[:,:-1,1:]) | (p != pos[:,1:,1:]) | (p != pos[:,1:,:-1])
+    q, r, c = sp.nonzero(mixed & ok)
+
+    # The edge numbers and corner values of each cell in counter-clockwise order
+    H = nr*(nc-1)
+    e = q*(H + (nr-1)*nc)
+    edges = sp.column_stack((e + r*(nc-1) + c, e + H + r*nc + c+1, e + (r+1)*(nc-1) + c, e + H + r*nc + c))
+    corners = sp.column_stack((d[q,r,c], d[q,r,c+1], d[q,r+1,c+1], d[q,r+1,c]))
+    pos = corners > 0
+    nxt = sp.roll(pos, -1, axis=1)
+    leaving = pos & ~nxt
+    crossed = pos != nxt
+    saddle_cut = (crossed.sum(axis=1) == 4) & (corners.mean(axis=1) <= 0)
+
+    # Pair each leaving edge with the next crossed edge, or the previous one
+    # in a saddle cell whose positive corners are cut off
+    src, dst = [], []
+    for k in range(4):
+        cells = sp.nonzero(leaving[:,k])[0]
+        cr = crossed[cells]
+        to = sp.where(cr[:,(k+1)%4], (k+1)%4, sp.where(cr[:,(k+2)%4], (k+2)%4, (k+3)%4))
+        to[saddle_cut[cells]] = (k+3)%4
+        src.append(edges[cells,k])
+        dst.append(edges[cells,to])
+    return sp.concatenate(src), sp.concatenate(dst)
+
+def _edge_points(d, x, y, e):
+    """px, py = _edge_points(d, x, y, e)
+    Finds where the zero contour of each matrix in the stack d crosses the
+    grid edges numbered e, by linear interpolation. For each matrix in turn,
+    the nr*(nc-1) horizontal edges, from d[k,r,c] to d[k,r,c+1], are numbered
+    first, row by row, followed by the (nr-1)*nc vertical edges, from d[k,r,c]
+    to d[k,r+1,c].
+    """
+    nr, nc = d.shape[1:]
+    H = nr*(nc-1)
+    q, e = divmod(e, H + (nr-1)*nc)
+    h = e < H
+    r = sp.where(h, e // (nc-1), (e-H) // nc)
+    c = sp.where(h, e % (nc-1), (e-H) % nc)
+    r2, c2 = r + ~h, c + h
+    t = d[q,r,c] / (d[q,r,c] - d[q,r2,c2])
+    return x[c] + t*(x[c2]-x[c]), y[r] + t*(y[r2]-y[r])
+
+def _trace(src, dst):
+    """idx = _trace(src, dst)
+    Chains segments into curves. Segment k goes from point src[k] to point
+    dst[k]. Every point may start at most one segment and
+    end at most one segment. Returns the point numbers of all of the curves
+    with -1 between curves. Closed curves end with their first point again.
+
+    The chains are followed for all of the points at once by pointer jumping:
+    each pass doubles the distance every point looks ahead, so it takes about
+    log2(n) passes. A closed curve is first opened at its lowest numbered
+    point, which is found the same way.
     """
-    h = plt.figure() # a dummy figure to draw the contours on
-    cs = plt.contour(x, y, d, levels=[0]) # creates a contour plot with a line at 0
-    paths = cs.collections[0].get_paths() # get the path of the null-cline
-    xy = paths[0].vertices # get the verticies of the path
-    plt.close(h) # close the dummy figure
-    return xy[:,0], xy[:,1]
+    if len(src) == 0:
+        return sp.zeros(0, dtype=int)
+
+    # Renumber the points so only those on a segment are used
+    used, inv = sp.unique(sp.concatenate((src, dst)), return_inverse=True)
+    n = len(used)
+    nxt = -sp.ones(n, dtype=int)
+    nxt[inv[:len(src)]] = inv[len(src):]
+    passes = int(sp.ceil(sp.log2(n))) + 1
+    ids = sp.arange(n)
+
+    # Find the closed curves and their lowest points and open them there
+    low, p = ids.copy(), sp.where(nxt < 0, ids, nxt)
+    for _ in range(passes):
+        low = sp.minimum(low, low[p])
+        p = p[p]
+    closed = nxt[p] >= 0
+    last = closed & (nxt == low)
+    nxt[last] = -1
+
+    # Find the distance from each point to the end of its curve
+    dist, p = (nxt >= 0).astype(int), sp.where(nxt < 0, ids, nxt)
+    for _ in range(passes):
+        dist = dist + dist[p]
+        p = p[p]
+
+    # Put the points in order, grouped by curve and from first to last, then
+    # close the closed curves and separate the curves with -1
+    order = sp.lexsort((-dist, p))
+    ends = sp.nonzero(sp.diff(p[order]))[0] + 1
+    firsts = order[sp.concatenate(([0], ends))]
+    ends = sp.concatenate((ends, [n]))
+    cl = closed[firsts]
+    at = sp.concatenate((ends[cl], ends[:-1]))
+    what = sp.concatenate((firsts[cl], -sp.ones(len(ends)-1, dtype=int)))
+    k = sp.argsort(at, kind='mergesort')
+    idx = sp.insert(order, at[k], what[k])
+    return sp.where(idx >= 0, used[idx], -1)
 
 
 def getCrossings(x1,y1, x2,y2):
@@ -37,10 +240,144 @@ def getCrossings(x1,y1, x2,y2):
     
     getCrossings approximates the places where two functions cross. x and y are
     the coordinates of those crossing points.
+
+    To cross the same curve with many others use CurveIndex instead.
     """
     x, y = _intersections(x1,y1, x2,y2)
     return x, y
 
+
+class CurveIndex(object):
+    """idx = CurveIndex(x1, y1)
+    CurveIndex builds a spatial index of the segments of a curve so that the
+    crossings of that curve with many other curves can be found without
+    redoing the work for the first curve each time. For example, to cross a
+    V-nullcline with the w-nullcline for each of a set of currents:
+
+      idx = CurveIndex(V_x, V_y)
+      crossings = idx.crossings_many([(w_x[k], w_y[k]) for k in range(n)])
+
+    Parameters:
+      x1 : The x-values of the curve, may be broken with NaNs.
+      y1 : The y-values of the curve.
+
+    The segments are dropped into a uniform grid of cells covering the curve.
+    The cells are about the size of a typical segment so each segment only
+    lands in a few cells, and there are at most about sqrt(n) cells to a side
+    so a long segment can't land in too many. A query curve is dropped into
+    the same grid and every pair of segments sharing a cell is a candidate
+    crossing. A pair of overlapping rectangles shares every cell covering their
+    overlap, so the pair is only kept from the cell holding the lower-left
+    corner of the overlap, which removes the duplicates without having to sort
+    them out. The candidates are then solved all at once (see _intersections).
+    """
+
+    def __init__(self, x1, y1):
+        _check_curve(x1, y1, 'X1', 'Y1')
+        self.xy, self.dxy, self.lo, self.hi = _segments(x1, y1)
+        n = len(self.dxy)
+
+        # Segments with a NaN vertex can never cross anything so they are
+        # left out of the grid
+        k = sp.nonzero(~sp.isnan(self.lo).any(axis=1) & ~sp.isnan(self.hi).any(axis=1))[0]
+        self.c_lo = sp.zeros((n, 2), dtype=int)
+        if len(k) == 0:
+            self.origin = self.top = sp.zeros(2)
+            self.size = sp.ones(2)
+            self.shape = sp.ones(2, dtype=int)
+            self.seg = self.cell = sp.zeros(0, dtype=int)
+            return
+
+        # Choose the cell size and get the cells each segment covers
+        self.origin = self.lo[k].min(axis=0)
+        self.top = self.hi[k].max(axis=0)
+        extent = self.top - self.origin
+        self.size = sp.maximum(sp.median(self.hi[k] - self.lo[k], axis=0),
+                               extent / sp.ceil(sp.sqrt(len(k))))
+        self.size[self.size == 0] = 1 # the curve is a horizontal or vertical line
+        self.shape = (extent // self.size).astype(int) + 1
+        c_lo, c_hi = self._cell_range(self.lo[k], self.hi[k])
+        self.c_lo[k] = c_lo
+
+        # Sort the (segment, cell) list by cell for looking up the cells later
+        seg, cell = _cells(c_lo, c_hi, self.shape)
+        order = sp.argsort(cell, kind='mergesort')
+        self.seg, self.cell = k[seg[order]], cell[order]
+
+    def crossings(self, x2, y2):
+        """x,y = idx.crossings(x2, y2)
+        Finds the crossings of the indexed curve with the curve x2,y2. The
+        result is the same as getCrossings(x1,y1, x2,y2).
+        """
+        _check_curve(x2, y2, 'X2', 'Y2')
+        xy2, dxy2, lo2, hi2 = _segments(x2, y2)
+        i, j = self._candidate_pairs(lo2, hi2)
+        order = sp.lexsort((j, i))
+        i, j = i[order], j[order]
+        x0, y0, crossed = _solve_pairs(self.xy, self.dxy, xy2, dxy2, i, j)
+        return x0, y0
+
+    def crossings_many(self, curves):
+        """crossings = idx.crossings_many(curves)
+        Finds the crossings of the indexed curve with each of the curves given
+        as a list of (x2, y2) pairs. All of the curves are handled at once. The
+        result is a list of (x, y) pairs, one for each curve, which are the
+        same as calling idx.crossings(x2, y2) for each curve.
+        """
+        if len(curves) == 0:
+            return []
+        segs = []
+        for x2, y2 in curves:
+            _check_curve(x2, y2, 'X2', 'Y2')
+            segs.append(_segments(x2, y2))
+        counts = [len(dxy2) for xy2, dxy2, lo2, hi2 in segs]
+        curve = sp.repeat(sp.arange(len(curves)), counts)
+        xy2 = sp.concatenate([xy2[:-1] for xy2, dxy2, lo2, hi2 in segs])
+        dxy2, lo2, hi2 = [sp.concatenate([s[n] for s in segs]) for n in (1, 2, 3)]
+
+        i, j = self._candidate_pairs(lo2, hi2)
+        order = sp.lexsort((j, i, curve[j]))
+        i, j = i[order], j[order]
+        x0, y0, crossed = _solve_pairs(self.xy, self.dxy, xy2, dxy2, i, j)
+        bounds = sp.searchsorted(curve[j[crossed]], sp.arange(len(curves) + 1))
+        return [(x0[a:b], y0[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _cell_range(self, lo, hi):
+        """c_lo, c_hi = idx._cell_range(lo, hi)
+        Gets the (column,row) of the first and last grid cells covered by each
+        of the rectangles given by the corners lo and hi.
+        """
+        c_lo = sp.clip(((lo - self.origin) // self.size).astype(int), 0, self.shape - 1)
+        c_hi = sp.clip(((hi - self.origin) // self.size).astype(int), 0, self.shape - 1)
+        return c_lo, c_hi
+
+    def _candidate_pairs(self, lo2, hi2):
+        """i, j = idx._candidate_pairs(lo2, hi2)
+        Finds all pairs of segments (i from the indexed curve, j from another
+        curve) whose enclosing rectangles overlap, given the corners of the
+        rectangles of the other curve as returned by _segments. Segments with
+        NaN vertices are never part of a pair.
+        """
+        # Drop segments with a NaN vertex along with those that lie entirely
+        # outside of the grid
+        k = sp.nonzero(~sp.isnan(lo2).any(axis=1) & ~sp.isnan(hi2).any(axis=1))[0]
+        k = k[(lo2[k] <= self.top).all(axis=1) & (hi2[k] >= self.origin).all(axis=1)]
+        c2_lo, c2_hi = self._cell_range(lo2[k], hi2[k])
+        s2, cell2 = _cells(c2_lo, c2_hi, self.shape)
+
+        # Join the two lists of (segment, cell) on the cell
+        start = sp.searchsorted(self.cell, cell2, 'left')
+        rep, off = _expand(sp.searchsorted(self.cell, cell2, 'right') - start)
+        i, b, cell = self.seg[start[rep] + off], s2[rep], cell2[rep]
+
+        # Remove the duplicates and the pairs that only share a cell
+        corner = sp.maximum(self.c_lo[i], c2_lo[b])
+        keep = cell == corner[:,0] + self.shape[0]*corner[:,1]
+        i, j = i[keep], k[b[keep]]
+        keep = (self.lo[i] <= hi2[j]).all(axis=1) & (self.hi[i] >= lo2[j]).all(axis=1)
+        return i[keep], j[keep]
+
+
 def _intersections(x1,y1, x2,y2):
     """X0,Y0 = intersections(X1,Y1,X2,Y2)
     INTERSECTIONS Intersections of curves.
@@ -55,17 +392,6 @@ def _intersections(x1,y1, x2,y2):
     X0 and Y0 are column vectors containing the points at which the two
     curves intersect.
 
-    The algorithm can return two additional vectors that indicate which
-    segment pairs contain intersections and where they are:
-
-      [X0,Y0,I,J] = intersections(X1,Y1,X2,Y2);
-    
-    For each element of the vector I, I(k) = (segment number of (X1,Y1)) +
-    (how far along this segment the intersection is).  For example, if I(k) =
-    45.25 then the intersection lies a quarter of the way between the line
-    segment connecting (X1(45),Y1(45)) and (X1(46),Y1(46)).  Similarly for
-    the vector J and the segments in (X2,Y2).
-
     Version: 1.10, 25 February 2008
     Converted to Python October 2010 by Jeffrey Bush jeff@coderforlife.com
     Author:  Douglas M. Schwarz
@@ -75,117 +401,96 @@ def _intersections(x1,y1, x2,y2):
     Theory of operation:
       Given two line segments, L1 and L2,
     
-      L1 endpoints:  (x1(1),y1(1)) and (x1(2),y1(2))
-      L2 endpoints:  (x2(1),y2(1)) and (x2(2),y2(2))
-    
-    we can write four equations with four unknowns and then solve them.  The
-    four unknowns are t1, t2, x0 and y0, where (x0,y0) is the intersection of
-    L1 and L2, t1 is the distance from the starting point of L1 to the
-    intersection relative to the length of L1 and t2 is the distance from the
-    starting point of L2 to the intersection relative to the length of L2.
-    
-    So, the four equations are
-    
-       (x1(2) - x1(1))*t1 = x0 - x1(1)
-       (x2(2) - x2(1))*t2 = x0 - x2(1)
-       (y1(2) - y1(1))*t1 = y0 - y1(1)
-       (y2(2) - y2(1))*t2 = y0 - y2(1)
-    
-    Rearranging and writing in matrix form,
+      L1 endpoints:  p = (x1(1),y1(1)) and p + r = (x1(2),y1(2))
+      L2 endpoints:  q = (x2(1),y2(1)) and q + s = (x2(2),y2(2))
     
-      [x1(2)-x1(1)       0       -1   0;      [t1;      [-x1(1);
-            0       x2(2)-x2(1)  -1   0;   *   t2;   =   -x2(1);
-       y1(2)-y1(1)       0        0  -1;       x0;       -y1(1);
-            0       y2(2)-y2(1)   0  -1]       y0]       -y2(1)]
+    the intersection (x0,y0) satisfies p + t1*r = q + t2*s, where t1 is the
+    distance from the starting point of L1 to the intersection relative to
+    the length of L1 and t2 is the same for L2.  Taking the 2-D cross product
+    (a x b = ax*by - ay*bx) of both sides with s and with r gives
     
-    Let's call that A*T = B.  We can solve for T with T = A\B.
+       t1 = ((q - p) x s) / (r x s)
+       t2 = ((q - p) x r) / (r x s)
     
-    Once we have our solution we just have to look at t1 and t2 to determine
-    whether L1 and L2 intersect.  If 0 <= t1 < 1 and 0 <= t2 < 1 then the two
-    line segments cross and we can include (x0,y0) in the output.
+    and then (x0,y0) = p + t1*r.  If 0 <= t1 < 1 and 0 <= t2 < 1 then the two
+    line segments cross and we can include (x0,y0) in the output.  When r x s
+    is zero the segments are parallel (or colinear) and t1 and t2 come out as
+    Inf or NaN, which fail the range test, so such pairs are never reported.
+    These formulas are evaluated for all segment pairs at once.
     
     In principle, we have to perform this computation on every pair of line
     segments in the input data.  This can be quite a large number of pairs so
-    we will reduce it by doing a simple preliminary check to eliminate line
-    segment pairs that could not possibly cross.  The check is to look at the
-    smallest enclosing rectangles (with sides parallel to the axes) for each
-    line segment pair and see if they overlap.  If they do then we have to
-    compute t1 and t2 (via the A\B computation) to see if the line segments
-    cross, but if they don't then the line segments cannot cross.  In a
-    typical application, this technique will eliminate most of the potential
-    line segment pairs.
-    """
-
-    # x1 and y1 must be vectors with same number of points (at least 2).
-    if sp.sum(sp.size(x1) > 1) != 1 or sp.sum(sp.size(y1) > 1) != 1 or len(x1) != len(y1):
-        raise ValueError('X1 and Y1 must be equal-length vectors of at least 2 points.')
-    # x2 and y2 must be vectors with same number of points (at least 2).
-    if sp.sum(sp.size(x2) > 1) != 1 or sp.sum(sp.size(y2) > 1) != 1 or len(x2) != len(y2):
-        raise ValueError('X2 and Y2 must be equal-length vectors of at least 2 points.')
-
-    # Compute number of line segments in each curve and some differences we'll
-    # need later.
-    n1 = len(x1) - 1
-    n2 = len(x2) - 1
-    xy1 = sp.column_stack((x1, y1))
-    xy2 = sp.column_stack((x2, y2))
-    dxy1 = sp.diff(xy1, axis=0)
-    dxy2 = sp.diff(xy2, axis=0)
-
-    # Determine the combinations of i and j where the rectangle enclosing the
-    # i'th line segment of curve 1 overlaps with the rectangle enclosing the
-    # j'th line segment of curve 2.
-    i, j = sp.nonzero(sp.logical_and(sp.logical_and(sp.logical_and(
-        sp.tile(sp.minimum(x1[0:-1],x1[1:]), (n2,1)).T <= sp.tile(sp.maximum(x2[0:-1],x2[1:]), (n1,1)), 
-	sp.tile(sp.maximum(x1[0:-1],x1[1:]), (n2,1)).T >= sp.tile(sp.minimum(x2[0:-1],x2[1:]), (n1,1))),
-	sp.tile(sp.minimum(y1[0:-1],y1[1:]), (n2,1)).T <= sp.tile(sp.maximum(y2[0:-1],y2[1:]), (n1,1))),
-	sp.tile(sp.maximum(y1[0:-1],y1[1:]), (n2,1)).T >= sp.tile(sp.minimum(y2[0:-1],y2[1:]), (n1,1)))
-        )
-    i = sp.copy(i) # make the arrays writable
-    j = sp.copy(j)
-
-    # Find segments pairs which have at least one vertex = NaN and remove them.
-    # This line is a fast way of finding such segment pairs.  We take
-    # advantage of the fact that NaNs propagate through calculations, in
-    # particular subtraction (in the calculation of dxy1 and dxy2, which we
-    # need anyway) and addition.
-    remove = sp.isnan(sp.sum(dxy1[i,:] + dxy2[j,:], axis=1))
-    i[remove] = []
-    j[remove] = []
-
-    # Initialize matrices.  We'll put the T's and B's in matrices and use them
-    # one column at a time.  AA is a 3-D extension of A where we'll use one
-    # plane at a time.
-    n = len(i)
-    T = sp.zeros((4, n))
-    AA = sp.zeros((4, 4, n))
-    AA[[0, 1],2,:] = -1
-    AA[[2, 3],3,:] = -1
-    AA[[0, 2],0,:] = dxy1[i,:].T
-    AA[[1, 3],1,:] = dxy2[j,:].T
-    B = -sp.array([x1[i], x2[j], y1[i], y2[j]])
-
-    # Loop through possibilities.  Trap singularity warning and then use
-    # lastwarn to see if that plane of AA is near singular.  Process any such
-    # segment pairs to determine if they are colinear (overlap) or merely
-    # parallel.  That test consists of checking to see if one of the endpoints
-    # of the curve 2 segment lies on the curve 1 segment.  This is done by
-    # checking the cross product
-    #
-    #   (x1(2),y1(2)) - (x1(1),y1(1)) x (x2(2),y2(2)) - (x1(1),y1(1)).
-    #
-    # If this is close to zero then the segments overlap.
-    for k in sp.arange(n):
-        L,U = lin.lu(AA[:,:,k], True)
-        T[:,k] = lin.solve(U, lin.solve(L, B[:,k]))
+    we will reduce it by only considering pairs whose smallest enclosing
+    rectangles (with sides parallel to the axes) overlap.  Instead of comparing
+    every rectangle of curve 1 to every rectangle of curve 2, the rectangles
+    are dropped into a uniform grid of cells covering curve 1 and only
+    segments sharing a cell are compared.  See CurveIndex for the details.
+    """
+    return CurveIndex(x1, y1).crossings(x2, y2)
+
+def _check_curve(x, y, xname, yname):
+    """_check_curve(x, y, xname, yname)
+    Raises a ValueError if x and y are not equal-length vectors of at least 2
+    points.
+    """
+    if sp.sum(sp.size(x) > 1) != 1 or sp.sum(sp.size(y) > 1) != 1 or len(x) != len(y):
+        raise ValueError('%s and %s must be equal-length vectors of at least 2 points.' % (xname, yname))
+
+def _segments(x, y):
+    """xy, dxy, lo, hi = _segments(x, y)
+    Returns the vertices of a curve as an n+1 by 2 array along with the n by 2
+    arrays of the segment differences and the lower-left and upper-right
+    corners of the rectangles enclosing each segment. Segments with a NaN
+    vertex have NaN corners.
+    """
+    xy = sp.column_stack((sp.asarray(x, dtype=float), sp.asarray(y, dtype=float)))
+    dxy = sp.diff(xy, axis=0)
+    lo = sp.minimum(xy[:-1], xy[1:])
+    hi = sp.maximum(xy[:-1], xy[1:])
+    return xy, dxy, lo, hi
+
+def _cells(c_lo, c_hi, shape):
+    """seg, cell = _cells(c_lo, c_hi, shape)
+    Lists every grid cell covered by each rectangle as parallel arrays of the
+    rectangle number and the flat cell number.
+    """
+    w = c_hi - c_lo + 1
+    seg, off = _expand(w[:,0] * w[:,1])
+    cx = c_lo[seg,0] + off % w[seg,0]
+    cy = c_lo[seg,1] + off // w[seg,0]
+    return seg, cx + shape[0]*cy
+
+def _expand(counts):
+    """rep, off = _expand(counts)
+    Expands a list of counts into a run for each entry. rep gives the entry
+    each element of the runs belongs to and off gives the position of the
+    element within its run. For example counts=[2,0,3] gives rep=[0,0,2,2,2]
+    and off=[0,1,0,1,2].
+    """
+    rep = sp.repeat(sp.arange(len(counts)), counts)
+    off = sp.arange(len(rep)) - sp.repeat(sp.cumsum(counts) - counts, counts)
+    return rep, off
+
+def _solve_pairs(xy1, dxy1, xy2, dxy2, i, j):
+    """x0, y0, crossed = _solve_pairs(xy1, dxy1, xy2, dxy2, i, j)
+    Finds where segment i[k] of curve 1 crosses segment j[k] of curve 2 for
+    all k at once, returning only the pairs that actually cross. crossed is a
+    mask of which of the pairs those are. See _intersections for the formulas.
+    """
+    p, r = xy1[i], dxy1[i]
+    s, qp = dxy2[j], xy2[j] - p
+    rs = r[:,0]*s[:,1] - r[:,1]*s[:,0]
+    with sp.errstate(divide='ignore', invalid='ignore'):
+        t1 = (qp[:,0]*s[:,1] - qp[:,1]*s[:,0]) / rs
+        t2 = (qp[:,0]*r[:,1] - qp[:,1]*r[:,0]) / rs
 
     # Find where t1 and t2 are between 0 and 1 and return the corresponding
     # x0 and y0 values.
-    in_range = sp.logical_and(sp.logical_and(sp.logical_and(T[0,:]>=0, T[1,:]>=0), T[0,:]<1), T[1,:]<1)
-    x0 = T[2,in_range].T
-    y0 = T[3,in_range].T
-
-    return x0, y0
+    in_range = (t1 >= 0) & (t2 >= 0) & (t1 < 1) & (t2 < 1)
+    t1 = t1[in_range]
+    x0 = p[in_range,0] + t1*r[in_range,0]
+    y0 = p[in_range,1] + t1*r[in_range,1]
+    return x0, y0, in_range
 
 
 def getJacobian(x,y,f,g,x0,y0):
@@ -206,30 +511,58 @@ def getJacobian(x,y,f,g,x0,y0):
     J(1,2): Derivative of f wrt y evaluated at x0, y0.
     J(2,1): Derivative of g wrt x evaluated at x0, y0.
     J(2,2): Derivative of g wrt y evaluated at x0, y0.
+
+    x0 and y0 can also be vectors, giving one Jacobian for each point. To get
+    Jacobians on the same grid many times use GridJacobian instead.
+    """
+    return GridJacobian(x,y,f,g)(x0,y0)
+
+
+class GridJacobian(object):
+    """jac = GridJacobian(x,y,f,g)
+    GridJacobian takes a grid of derivative values and computes the partial
+    derivatives of f and g over the whole grid once, after which jac(x0,y0)
+    returns the Jacobian at any points in phase space quickly. The arguments
+    are the same as for getJacobian.
+
+    Parameters:
+      x   : The x-values of f and g, either the x-values of the columns or
+            the matrix from meshgrid. Must be increasing.
+      y   : The y-values of f and g, either the y-values of the rows or the
+            matrix from meshgrid. Must be increasing.
+      f   : A matrix approximating the derivative wrt x.
+      g   : A matrix approximating the derivative wrt y.
+
+    The partial derivatives at the points are found by bilinear interpolation
+    in the grid cell holding each point. Points outside of the grid give NaNs.
     """
-    dx = sp.gradient(x)[1] # the derivative in the X direction
-    dy = sp.gradient(y)[0] # the derivative in the Y direction
-    dfy, dfx = sp.gradient(f) # the derivatives of f in the X and Y directions
-    dgy, dgx = sp.gradient(g) # the derivatives of g in the X and Y directions
-
-    # Now we need to get the values at the fixed point. We have to interpolate
-    # the data from what we have.
-    points = (x.flatten(), y.flatten())
-    point = (x0, y0)
-    dx0   = griddata(points, dx.flatten(),  point)
-    dy0   = griddata(points, dy.flatten(),  point)
-    dfdx0 = griddata(points, dfx.flatten(), point)
-    dfdy0 = griddata(points, dfy.flatten(), point)
-    dgdx0 = griddata(points, dgx.flatten(), point)
-    dgdy0 = griddata(points, dgy.flatten(), point)
-
-    #X, Y = x.flatten(), y.flatten()
-    #xi,yi = plt.meshgrid([x0-1, x0, x0+1], [y0-1, y0, y0+1])
-    #dx0   = griddata(X, Y, dx.flatten(), xi,yi)[1][1]
-    #dy0   = griddata(X, Y, dy.flatten(), xi,yi)[1][1]
-    #dfdx0 = griddata(X, Y, dfx.flatten(),xi,yi)[1][1]
-    #dfdy0 = griddata(X, Y, dfy.flatten(),xi,yi)[1][1]
-    #dgdx0 = griddata(X, Y, dgx.flatten(),xi,yi)[1][1]
-    #dgdy0 = griddata(X, Y, dgy.flatten(),xi,yi)[1][1]
-
-    return sp.array([[dfdx0/dx0, dfdy0/dy0], [dgdx0/dx0, dgdy0/dy0]])
+
+    def __init__(self, x, y, f, g):
+        self.x, self.y = _grid_vectors(x, y)
+        dx = sp.gradient(self.x) # the spacing in the X direction
+        dy = sp.gradient(self.y)[:,None] # the spacing in the Y direction
+        dfy, dfx = sp.gradient(sp.asarray(f, dtype=float)) # the derivatives of f in the X and Y directions
+        dgy, dgx = sp.gradient(sp.asarray(g, dtype=float)) # the derivatives of g in the X and Y directions
+        self.partials = sp.array([dfx/dx, dfy/dy, dgx/dx, dgy/dy])
+
+    def __call__(self, x0, y0):
+        """J = jac(x0,y0)
+        Returns the Jacobian at the point x0, y0 as a 2x2 matrix. If x0 and
+        y0 are arrays the result has two extra dimensions at the end, so
+        J[k] is the Jacobian at x0[k], y0[k].
+        """
+        x0, y0 = sp.broadcast_arrays(sp.asarray(x0, dtype=float), sp.asarray(y0, dtype=float))
+        shape = x0.shape
+        x0, y0 = x0.ravel(), y0.ravel()
+
+        # Find the cell each point is in and how far across the cell it is
+        c = sp.clip(sp.searchsorted(self.x, x0, 'right') - 1, 0, len(self.x) - 2)
+        r = sp.clip(sp.searchsorted(self.y, y0, 'right') - 1, 0, len(self.y) - 2)
+        tx = (x0 - self.x[c]) / (self.x[c+1] - self.x[c])
+        ty = (y0 - self.y[r]) / (self.y[r+1] - self.y[r])
+
+        P = self.partials
+        J = ((1-ty)*((1-tx)*P[:,r,c] + tx*P[:,r,c+1]) +
+                ty *((1-tx)*P[:,r+1,c] + tx*P[:,r+1,c+1]))
+        J[:,~((tx >= 0) & (tx <= 1) & (ty >= 0) & (ty <= 1))] = sp.nan
+        return J.T.reshape(shape + (2,2))
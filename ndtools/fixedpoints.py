@@ -0,0 +1,172 @@
+"""
+Tools for finding and classifying the fixed points of a vector field given as
+a function, like the one passed to odeint, instead of as values on a grid.
+
+A rough guess at the fixed points, such as the crossings of the nullclines
+found with getCrossings on a coarse grid, is refined with Newton's method and
+the Jacobian at each fixed point is computed from the function directly.
+Everything is done for all of the points at once, so the function must accept
+a state whose components are arrays (one value for each point), as most
+functions written with scipy do.
+"""
+
+import scipy as sp
+import numpy.linalg as lin
+
+def getFixedPoints(f, x0, y0, t=0, tol=1e-10, maxiter=50, method='central'):
+    """x,y,J,eigs,labels = getFixedPoints(f, x0, y0, t=0, tol=1e-10, maxiter=50, method='central')
+    getFixedPoints takes a two-dimensional vector field and guesses at its
+    fixed points, refines the guesses, and classifies the fixed points. For
+    example, with the Morris-Lecar model ML(Vw, t):
+
+      nc1_V, nc1_w = getNullcline(DVdt, V, w)
+      nc2_V, nc2_w = getNullcline(Dwdt, V, w)
+      fp_V, fp_w = getCrossings(nc1_V, nc1_w, nc2_V, nc2_w)
+      fp_V, fp_w, J, eigs, labels = getFixedPoints(ML, fp_V, fp_w)
+
+    Parameters:
+      f   : The vector field, called as f((x,y), t) and returning (dx/dt,
+            dy/dt) like the functions given to odeint.
+      x0  : The x-values of the guesses.
+      y0  : The y-values of the guesses.
+      t   : The time to pass to f.
+      tol, maxiter, method : See refineFixedPoints and getFieldJacobian.
+
+    Returns:
+      x,y : The x and y values of the fixed points. Guesses that did not
+            converge are dropped.
+      J   : The Jacobian at each fixed point, J[k] is the 2x2 matrix for the
+            point x[k], y[k].
+      eigs: The eigenvalues of each Jacobian.
+      labels : The type of each fixed point, see classifyFixedPoints.
+    """
+    X = sp.array([sp.atleast_1d(sp.asarray(x0, dtype=float)), sp.atleast_1d(sp.asarray(y0, dtype=float))])
+    X, converged = refineFixedPoints(f, X, t, tol, maxiter, method)
+    X = X[:,converged]
+    J = getFieldJacobian(f, X, t, method)
+    eigs, labels = classifyFixedPoints(J)
+    return X[0], X[1], J, eigs, labels
+
+def refineFixedPoints(f, X, t=0, tol=1e-10, maxiter=50, method='central'):
+    """X,converged = refineFixedPoints(f, X, t=0, tol=1e-10, maxiter=50, method='central')
+    refineFixedPoints improves guesses at the fixed points of a vector field
+    of any dimension using Newton's method on all of the guesses at once.
+
+    Parameters:
+      f   : The vector field, called as f(X, t) like the functions given to
+            odeint.
+      X   : The guesses, X[:,k] is the state of the k-th guess.
+      t   : The time to pass to f.
+      tol : A guess has converged when the Newton step is less than tol
+            relative to the size of the state in every component.
+      maxiter : The maximum number of Newton steps to take.
+      method : How to compute the Jacobian, see getFieldJacobian.
+
+    Returns:
+      X   : The refined guesses.
+      converged : Which guesses converged. Guesses where the Jacobian is
+                  singular or the values are not finite stop early and are
+                  marked as not converged.
+    """
+    X = sp.array(X, dtype=float)
+    n = X.shape[1]
+    converged = sp.zeros(n, dtype=bool)
+    active = sp.arange(n)
+    for it in range(maxiter):
+        if len(active) == 0:
+            break
+        Xa = X[:,active]
+        F = _field(f, Xa, t)
+        J = getFieldJacobian(f, Xa, t, method)
+
+        # Give up on points that can't take a step
+        ok = sp.isfinite(F).all(axis=0) & sp.isfinite(J).all(axis=(1,2))
+        ok[ok] = lin.det(J[ok]) != 0
+        active, Xa, F, J = active[ok], Xa[:,ok], F[:,ok], J[ok]
+
+        step = lin.solve(J, F.T[:,:,None])[:,:,0].T
+        Xa = Xa - step
+        X[:,active] = Xa
+        done = (abs(step) <= tol*(1 + abs(Xa))).all(axis=0)
+        converged[active[done]] = True
+        active = active[~done]
+    return X, converged
+
+def getFieldJacobian(f, X, t=0, method='central'):
+    """J = getFieldJacobian(f, X, t=0, method='central')
+    getFieldJacobian computes the Jacobian of a vector field of any dimension
+    at many points at once.
+
+    Parameters:
+      f   : The vector field, called as f(X, t) like the functions given to
+            odeint.
+      X   : The points, X[:,k] is the state of the k-th point.
+      t   : The time to pass to f.
+      method : 'central' to use central differences, or 'complex' to use the
+               complex-step derivative. The complex step is accurate to
+               machine precision but f must work with complex states and be
+               analytic (no abs, comparisons, etc).
+
+    Returns:
+      J   : J[k] is the Jacobian at X[:,k], J[k,i,j] is the derivative of the
+            i-th component of f wrt the j-th component of the state.
+    """
+    X = sp.asarray(X, dtype=float)
+    d, n = X.shape
+    J = sp.empty((n, d, d))
+    if method == 'central':
+        h = sp.finfo(float).eps**(1/3.) * sp.maximum(abs(X), 1)
+        for j in range(d):
+            Xp, Xm = X.copy(), X.copy()
+            Xp[j] += h[j]
+            Xm[j] -= h[j]
+            J[:,:,j] = ((_field(f, Xp, t) - _field(f, Xm, t)) / (2*h[j])).T
+    elif method == 'complex':
+        h = 1e-20
+        for j in range(d):
+            Xc = X.astype(complex)
+            Xc[j] += 1j*h
+            J[:,:,j] = (_field(f, Xc, t).imag / h).T
+    else:
+        raise ValueError("method must be 'central' or 'complex'")
+    return J
+
+def classifyFixedPoints(J, tol=1e-9):
+    """eigs,labels = classifyFixedPoints(J, tol=1e-9)
+    classifyFixedPoints takes the Jacobians at fixed points, J[k] for the
+    k-th point, and returns their eigenvalues and the type of each point,
+    which is one of:
+
+      'stable node'     : all eigenvalues are real and negative
+      'unstable node'   : all eigenvalues are real and positive
+      'stable focus'    : all eigenvalues have negative real parts and some
+                          are complex
+      'unstable focus'  : all eigenvalues have positive real parts and some
+                          are complex
+      'saddle'          : there are eigenvalues with positive and negative
+                          real parts
+      'center'          : some eigenvalues are imaginary and the rest have
+                          negative real parts
+      'non-hyperbolic'  : any other point with an eigenvalue with zero real
+                          part
+
+    Real parts and imaginary parts smaller than tol are counted as zero.
+    """
+    eigs = lin.eigvals(J)
+    re, im = eigs.real, abs(eigs.imag)
+    neg = (re < -tol).all(axis=-1)
+    pos = (re > tol).all(axis=-1)
+    saddle = (re < -tol).any(axis=-1) & (re > tol).any(axis=-1)
+    cplx = (im > tol).any(axis=-1)
+    zero = abs(re) <= tol
+    center = zero.any(axis=-1) & ((zero & (im > tol)) | (re < -tol)).all(axis=-1)
+    labels = sp.select([neg & ~cplx, pos & ~cplx, neg, pos, saddle, center],
+                       ['stable node', 'unstable node', 'stable focus', 'unstable focus', 'saddle', 'center'],
+                       'non-hyperbolic')
+    return eigs, labels
+
+def _field(f, X, t):
+    """F = _field(f, X, t)
+    Evaluates the vector field at all of the points X[:,k] at once.
+    """
+    return sp.array([sp.zeros_like(X[0]) + Fi for Fi in f(X, t)])
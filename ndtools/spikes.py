@@ -7,8 +7,8 @@ Written by Jeffrey Bush (jeff@coderforlife.com) 2010
 
 import scipy as sp
 
-def isi(t, V, spike_thresh=0):
-    """isi_mean, isi_dev = isi(t, V, spike_thresh=0)
+def isi(t, V, spike_thresh=0, interp=None):
+    """isi_mean, isi_dev = isi(t, V, spike_thresh=0, interp=None)
 
     Given voltage (V) and time (t) vectors, isi calculates the mean interspike
     interval (isi_mean) and the standard deviation of the interspike interval
@@ -16,6 +16,11 @@ def isi(t, V, spike_thresh=0):
 
     You can optionally specify the spike threshold (defaults to 0).
 
+    The spike times are the times of the samples just before the voltage
+    crosses the threshold. You can optionally give interp as 'linear' or
+    'cubic' to instead interpolate the time the voltage crosses the
+    threshold, which is much more accurate for coarsely sampled traces.
+
     This uses an assumption that every time it spikes, the voltage increases
     above the given spike threshold.
 
@@ -23,18 +28,19 @@ def isi(t, V, spike_thresh=0):
     likely be false positives. With a model however, it should work very
     well.
     """
-    time = t[sp.logical_and(V[:-1] < spike_thresh, V[1:] >= spike_thresh)]
+    time = _spike_times(t, V, spike_thresh, interp)
     dt = sp.diff(time)
     return sp.mean(dt), sp.std(dt)
 
-def spk_phase(t, V1, V2, spike_thresh=0):
-    """phase_mean, isi_mean = spk_phase(t, V1, V2, spike_thresh=0)
+def spk_phase(t, V1, V2, spike_thresh=0, interp=None):
+    """phase_mean, isi_mean = spk_phase(t, V1, V2, spike_thresh=0, interp=None)
     
     Given two voltage vectors (V1 and V2) and time vector (t), phase calculates
     the mean phase of the spikes in radians (phase_mean) and the mean
     interspike interval (isi_mean).
 
-    You can optionally specify the spike threshold (defaults to 0).
+    You can optionally specify the spike threshold (defaults to 0) and how to
+    interpolate the spike times (see isi).
 
     This uses an assumption that every time it spikes, the voltage increases
     above the given spike threshold.
@@ -44,10 +50,289 @@ def spk_phase(t, V1, V2, spike_thresh=0):
     well.
     """
     
-    time1 = t[sp.logical_and(V1[:-1] < spike_thresh, V1[1:] >= spike_thresh)]
-    time2 = t[sp.logical_and(V2[:-1] < spike_thresh, V2[1:] >= spike_thresh)]
+    time1 = _spike_times(t, V1, spike_thresh, interp)
+    time2 = _spike_times(t, V2, spike_thresh, interp)
 
     l = sp.amin([len(time1), len(time2)])
     isi_mean = sp.mean(sp.diff(time1))
     phase_mean = sp.mean((time1[0:l]-time2[0:l]) / isi_mean * 2 * sp.pi)
     return phase_mean, isi_mean
+
+def spike_trains(t, V, spike_thresh=0, interp=None):
+    """times, offsets = spike_trains(t, V, spike_thresh=0, interp=None)
+
+    Given a voltage array (V) with one column for each neuron and time vector
+    (t), spike_trains finds the spike times of every neuron at once. The spike
+    times of neuron k are times[offsets[k]:offsets[k+1]], found the same way
+    as in isi.
+
+    You can optionally specify the spike threshold (defaults to 0) and how to
+    interpolate the spike times (see isi).
+    """
+    t, V = sp.asarray(t), sp.asarray(V)
+    crossed = sp.logical_and(V[:-1] < spike_thresh, V[1:] >= spike_thresh)
+    neuron, k = sp.nonzero(crossed.T) # neuron by neuron, in time order
+    offsets = sp.searchsorted(neuron, sp.arange(V.shape[1] + 1))
+    return _crossing_times(t, V, k, spike_thresh, interp, neuron), offsets
+
+def isi_multi(t, V, spike_thresh=0, interp=None):
+    """isi_mean, isi_dev = isi_multi(t, V, spike_thresh=0, interp=None)
+
+    Given a voltage array (V) with one column for each neuron and time vector
+    (t), isi_multi calculates the mean interspike interval (isi_mean) and the
+    standard deviation of the interspike interval (isi_dev) of every neuron
+    at once. The results are the same as isi for each column of V, with NaNs
+    for neurons with less than two spikes.
+
+    You can optionally specify the spike threshold (defaults to 0) and how to
+    interpolate the spike times (see isi).
+    """
+    times, offsets = spike_trains(t, V, spike_thresh, interp)
+    return _isi_stats(times, offsets)
+
+def spk_phase_matrix(t, V, spike_thresh=0, interp=None):
+    """phase_mean, isi_mean = spk_phase_matrix(t, V, spike_thresh=0, interp=None)
+
+    Given a voltage array (V) with one column for each neuron and time vector
+    (t), spk_phase_matrix calculates the mean phase of the spikes in radians
+    between every pair of neurons (phase_mean) and the mean interspike
+    interval of every neuron (isi_mean). phase_mean[i,j] is the same as
+    spk_phase(t, V[:,i], V[:,j]) and so is measured in units of the
+    interspike interval of neuron i.
+
+    You can optionally specify the spike threshold (defaults to 0) and how to
+    interpolate the spike times (see isi).
+
+    spk_phase pairs up the first spikes of each neuron, as many as the neuron
+    with fewer spikes has. The mean of the time differences of the first l
+    pairs is the difference of the sums of the first l spike times of each
+    neuron divided by l, so this only needs the cumulative sums of the spike
+    times of each neuron and never forms the pairs.
+    """
+    times, offsets = spike_trains(t, V, spike_thresh, interp)
+    isi_mean, isi_dev = _isi_stats(times, offsets)
+
+    # The sum of the first l spike times of neuron k is
+    # csum[offsets[k]+l] - csum[offsets[k]]
+    csum = sp.concatenate(([0], sp.cumsum(times)))
+    counts = sp.diff(offsets)
+    l = sp.minimum(counts[:,None], counts[None,:])
+    start = offsets[:-1]
+    sum1 = csum[start[:,None] + l] - csum[start[:,None]]
+    sum2 = csum[start[None,:] + l] - csum[start[None,:]]
+    with sp.errstate(divide='ignore', invalid='ignore'):
+        phase_mean = (sum1 - sum2) / l / isi_mean[:,None] * 2 * sp.pi
+    return phase_mean, isi_mean
+
+def _isi_stats(times, offsets):
+    """isi_mean, isi_dev = _isi_stats(times, offsets)
+
+    Calculates the mean and standard deviation of the interspike intervals of
+    each of the spike trains given as by spike_trains.
+    """
+    n = len(offsets) - 1
+    neuron = sp.repeat(sp.arange(n), sp.diff(offsets))
+    same = neuron[1:] == neuron[:-1] # intervals within one spike train
+    neuron, dt = neuron[1:][same], sp.diff(times)[same]
+    count = sp.bincount(neuron, minlength=n)
+    with sp.errstate(divide='ignore', invalid='ignore'):
+        isi_mean = sp.bincount(neuron, dt, minlength=n) / count
+        isi_dev = sp.sqrt(sp.bincount(neuron, (dt - isi_mean[neuron])**2, minlength=n) / count)
+    return isi_mean, isi_dev
+
+def spike_event(index=0, spike_thresh=0):
+    """event = spike_event(index=0, spike_thresh=0)
+
+    Makes an event function for scipy.integrate.solve_ivp that finds the
+    times the voltage (the given index of the state) increases past the spike
+    threshold, so the integrator locates the spike times itself instead of
+    them being limited to the output samples. For example:
+
+      sol = solve_ivp(HH, (0, 1000), y0, events=spike_event(0, -20))
+      time = sol.t_events[0]
+      isi_mean, isi_dev = sp.mean(sp.diff(time)), sp.std(sp.diff(time))
+
+    For several neurons give a list of events, one for each voltage.
+    """
+    def event(t, y):
+        return y[index] - spike_thresh
+    event.terminal = False
+    event.direction = 1
+    return event
+
+def _spike_times(t, V, spike_thresh, interp):
+    """time = _spike_times(t, V, spike_thresh, interp)
+
+    Finds the spike times in a single voltage trace.
+    """
+    t, V = sp.asarray(t), sp.asarray(V)
+    k = sp.nonzero(sp.logical_and(V[:-1] < spike_thresh, V[1:] >= spike_thresh))[0]
+    return _crossing_times(t, V, k, spike_thresh, interp)
+
+def _crossing_times(t, V, k, spike_thresh, interp, j=None):
+    """time = _crossing_times(t, V, k, spike_thresh, interp, j=None)
+
+    Gets the times the voltage crosses the threshold between samples k and
+    k+1. If j is given V has a column for each neuron and crossing i is in
+    column j[i].
+
+    With interp None the time of sample k is used. With 'linear' the
+    crossing of the line through samples k and k+1 is used. With 'cubic' the
+    crossing of the cubic through samples k-1 to k+2 is found by a few Newton
+    steps from the linear guess. At the ends of the trace, and anywhere the
+    cubic doesn't cross between samples k and k+1, the linear time is used.
+    """
+    if interp is None:
+        return t[k]
+    if interp not in ('linear', 'cubic'):
+        raise ValueError("interp must be None, 'linear' or 'cubic'")
+    v = (lambda m: V[k+m]) if j is None else (lambda m: V[k+m,j])
+    t0, t1, V0, V1 = t[k], t[k+1], v(0), v(1)
+    time = t0 + (spike_thresh - V0) / (V1 - V0) * (t1 - t0)
+    if interp == 'linear':
+        return time
+
+    # Only the crossings with two samples on each side get the cubic
+    inner = sp.logical_and(k >= 1, k + 2 < len(t))
+    ki, tc = k[inner], time[inner]
+    ji = None if j is None else j[inner]
+    x = [t[ki+m] for m in (-1, 0, 1, 2)]
+    y = [(V[ki+m] if ji is None else V[ki+m,ji]) - spike_thresh for m in (-1, 0, 1, 2)]
+
+    # Newton's divided differences for the cubic through the four samples
+    d1 = [(y[m+1] - y[m]) / (x[m+1] - x[m]) for m in range(3)]
+    d2 = [(d1[m+1] - d1[m]) / (x[m+2] - x[m]) for m in range(2)]
+    d3 = (d2[1] - d2[0]) / (x[3] - x[0])
+    with sp.errstate(divide='ignore', invalid='ignore'):
+        for it in range(4):
+            u = d2[0] + (tc - x[2])*d3
+            w = d1[0] + (tc - x[1])*u
+            p = y[0] + (tc - x[0])*w
+            dp = w + (tc - x[0])*(u + (tc - x[1])*d3)
+            tc = tc - p / dp
+    ok = sp.logical_and(tc >= x[1], tc <= x[2]) # also false for NaN
+    time[sp.nonzero(inner)[0][ok]] = tc[ok]
+    return time
+
+class SpikeDetector(object):
+    """det = SpikeDetector(spike_thresh=0, interp=None)
+
+    SpikeDetector finds spikes in a voltage trace that is given a piece at a
+    time, such as a trace too large to keep in memory or one produced by an
+    integrator a step at a time. It keeps the running mean and variance of
+    the interspike interval without keeping the spikes, so it uses a constant
+    amount of memory. Spikes are found the same way as isi does, so after
+    feeding it all of t and V the results are the same as isi(t, V).
+
+    For example, with a trace saved with numpy.save:
+
+      t = numpy.load('t.npy', mmap_mode='r')
+      V = numpy.load('V.npy', mmap_mode='r')
+      isi_mean, isi_dev = SpikeDetector(-20).run(chunks(t, V, 100000))
+
+    You can optionally specify the spike threshold (defaults to 0) and how to
+    interpolate the spike times (see isi).
+    """
+
+    def __init__(self, spike_thresh=0, interp=None):
+        self.spike_thresh = spike_thresh
+        self.interp = interp
+        self.count = 0 # the number of spikes found so far
+        self.last_spike = None # the time of the last spike found
+        self._t = self._V = None # the last few samples of the previous chunks
+        self._seen = 0 # the number of pairs of samples in _t already searched
+        self._n, self._mean, self._M2 = 0, 0.0, 0.0 # the interspike interval statistics
+
+    def update(self, t, V):
+        """spikes = det.update(t, V)
+
+        Finds the spikes in the next chunk of the trace and returns their
+        times. A spike that crosses the threshold between the end of the last
+        chunk and the start of this one is included. With cubic interpolation
+        a spike in the last two samples is held back until the next chunk (or
+        finish).
+        """
+        t, V = sp.asarray(t), sp.asarray(V)
+        if len(t) == 0:
+            return t[:0]
+        if self._t is not None:
+            t, V = sp.concatenate((self._t, t)), sp.concatenate((self._V, V))
+        return self._search(t, V, len(t) - (2 if self.interp == 'cubic' else 1))
+
+    def finish(self):
+        """spikes = det.finish()
+
+        Finds any spike held back at the end of the last chunk and returns
+        its time. Call this after the last chunk (run does this for you).
+        """
+        if self._t is None:
+            return sp.zeros(0)
+        return self._search(self._t, self._V, len(self._t) - 1)
+
+    def _search(self, t, V, end):
+        """spikes = det._search(t, V, end)
+
+        Finds the spikes between the pairs of samples not yet searched up to
+        the pair starting at end, then keeps the last few samples to be
+        joined to the next chunk.
+        """
+        thresh = self.spike_thresh
+        start = min(self._seen, end)
+        k = start + sp.nonzero(sp.logical_and(V[start:end] < thresh, V[start+1:end+1] >= thresh))[0]
+        spikes = _crossing_times(t, V, k, thresh, self.interp)
+        keep = max(len(t) - 3, 0)
+        self._t, self._V = t[keep:].copy(), V[keep:].copy()
+        self._seen = max(end - keep, 0)
+        self._add(spikes)
+        return spikes
+
+    def _add(self, spikes):
+        """det._add(spikes)
+
+        Adds newly found spikes to the interspike interval statistics.
+        """
+        if len(spikes) == 0:
+            return
+
+        # Merge the statistics of the new intervals into the running ones
+        # (Chan et al's parallel form of Welford's algorithm)
+        dt = sp.diff(spikes if self.last_spike is None else sp.concatenate(([self.last_spike], spikes)))
+        if len(dt) > 0:
+            n, mean = len(dt), sp.mean(dt)
+            delta = mean - self._mean
+            total = self._n + n
+            self._mean += delta * n / total
+            self._M2 += sp.sum((dt - mean)**2) + delta**2 * self._n * n / total
+            self._n = total
+        self.count += len(spikes)
+        self.last_spike = spikes[-1]
+
+    def run(self, chunks):
+        """isi_mean, isi_dev = det.run(chunks)
+
+        Feeds every (t, V) chunk from chunks (a list, generator, etc) to
+        update and returns the interspike interval statistics.
+        """
+        for t, V in chunks:
+            self.update(t, V)
+        self.finish()
+        return self.isi_mean, self.isi_dev
+
+    @property
+    def isi_mean(self):
+        """The mean interspike interval so far (NaN if there are less than 2 spikes)"""
+        return self._mean if self._n > 0 else sp.nan
+
+    @property
+    def isi_dev(self):
+        """The standard deviation of the interspike interval so far (NaN if there are less than 2 spikes)"""
+        return sp.sqrt(self._M2 / self._n) if self._n > 0 else sp.nan
+
+def chunks(t, V, size):
+    """for t_chunk, V_chunk in chunks(t, V, size)
+
+    Splits t and V into chunks of at most size samples for a SpikeDetector.
+    Works with memory-mapped arrays without reading them all in.
+    """
+    for i in range(0, len(t), size):
+        yield t[i:i+size], V[i:i+size]
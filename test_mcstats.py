@@ -0,0 +1,47 @@
+"""
+Checks of the stopping rule in mcstats against AR(1) streams, whose integrated autocorrelation time
+(1 + phi) / (2 (1 - phi)) and variance 1 / (1 - phi**2) are known exactly.
+"""
+
+import numpy as np
+
+from mcstats import Estimator, run_until
+
+
+def _ar1(phi, seed):
+    rng = np.random.RandomState(seed)
+    x = [0.0]
+
+    def step():
+        x[0] = phi * x[0] + rng.randn()
+
+    return step, lambda: x[0]
+
+
+def test_strongly_correlated_stream_does_not_stop_early():
+    # tau is about 1000 samples, so no error estimate can be trusted in 20000 samples and the target,
+    # far above the naive error, must not end the run
+    for seed in range(3):
+        step, measure = _ar1(0.999, seed)
+        est, samples = run_until(step, measure, 3.0, max_samples=20000)
+        assert len(samples) == 20000
+        assert not est.plateaued()
+
+
+def test_weakly_correlated_stream_stops_with_calibrated_error():
+    phi = 0.5
+    tau = (1 + phi) / (2 * (1 - phi))
+    var = 1 / (1 - phi ** 2)
+    step, measure = _ar1(phi, 0)
+    est, samples = run_until(step, measure, 0.05)
+    assert len(samples) < 100000
+    assert est.plateaued()
+    true_err = np.sqrt(2 * tau * var / est.n)
+    assert 0.7 * true_err < est.stderr() <= 0.05
+    assert abs(est.tau() - tau) < 0.5 * tau
+
+
+def test_constant_stream_converges():
+    est = Estimator()
+    est.extend(np.ones(1000))
+    assert est.converged(1e-6)